@@ -33,15 +33,47 @@ class Config:
     CTX_SNIPPET_CHARS = int(os.getenv("CTX_SNIPPET_CHARS", "900"))
     EMBED_BATCH = int(os.getenv("EMBED_BATCH", "100"))
     EMBED_RPS = float(os.getenv("EMBED_RPS", "0.5"))
+    EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # embed batches in flight at once
+    # how long a search query waits for others to share its embed call; 0 disables
+    EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "20"))
+    SLM_RANK_BATCH_CHARS = int(os.getenv("SLM_RANK_BATCH_CHARS", "60000"))  # candidate text per multi-PDF ranking call
+    # extraction processes, kept for the server's lifetime; 0 or 1 extracts in-process
+    PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))
+    PDF_EXTRACT_POOL_PAGES = int(os.getenv("PDF_EXTRACT_POOL_PAGES", "200"))  # fewer pages per pass stay in-process
+    # shortlist topk_search over an int8 copy of the vectors (needs numba)
+    RAG_INT8_SEARCH = os.getenv("RAG_INT8_SEARCH", "0") == "1"
+    RAG_INT8_RERANK = int(os.getenv("RAG_INT8_RERANK", "256"))  # int8 candidates re-scored in float32
+    # switch topk_search to an HNSW graph above this many rows (needs hnswlib)
+    ANN_THRESHOLD = int(os.getenv("ANN_THRESHOLD", "50000"))
+    ANN_EF = int(os.getenv("ANN_EF", "64"))  # HNSW search breadth; raise for recall
+    # removed rows are only masked until the live fraction drops below this, then compacted
+    RAG_COMPACT_BELOW = float(os.getenv("RAG_COMPACT_BELOW", "0.8"))
     GEN_RPS = float(os.getenv("GEN_RPS", "0.2"))
     MAX_RETRIES = int(os.getenv("MAX_RETRIES", "8"))
     BASE_BACKOFF = float(os.getenv("BASE_BACKOFF", "1.5"))
     MAX_BACKOFF = float(os.getenv("MAX_BACKOFF", "20.0"))
 
+    # Podcast
+    # render script sections concurrently (one LLM call per section) instead of one streamed
+    # call; these calls are not throttled by GEN_RPS, so it is opt-in
+    PODCAST_PARALLEL_SECTIONS = os.getenv("PODCAST_PARALLEL_SECTIONS", "0") == "1"
+    # create the genai client in a background thread at import instead of on first request
+    PODCAST_PREWARM = os.getenv("PODCAST_PREWARM", "0") == "1"
+    # entries kept in each in-process LLM response cache (beats, scripts); 0 disables
+    PODCAST_LLM_CACHE_SIZE = int(os.getenv("PODCAST_LLM_CACHE_SIZE", "256"))
+    # reuse beats for near-duplicate selections (costs one embedding call per cache miss)
+    PODCAST_SEMANTIC_CACHE = os.getenv("PODCAST_SEMANTIC_CACHE", "0") == "1"
+    PODCAST_SEMANTIC_THRESHOLD = float(os.getenv("PODCAST_SEMANTIC_THRESHOLD", "0.92"))
+
     # RAG files
-    VEC_PATH = os.path.join(RAG_DIR, "vectors.npy")
+    VEC_PATH = os.path.join(RAG_DIR, "vectors.f32")
+    VEC_SHAPE_PATH = os.path.join(RAG_DIR, "vectors.json")
+    VEC_LEGACY_PATH = os.path.join(RAG_DIR, "vectors.npy")  # pre-memmap snapshot, imported once
     META_PATH = os.path.join(RAG_DIR, "meta.jsonl")
-    EMBED_CACHE_PATH = os.path.join(RAG_DIR, "embed_cache.jsonl")
+    EMBED_CACHE_PATH = os.path.join(RAG_DIR, "embed_cache.jsonl")  # legacy format, imported once
+    EMBED_CACHE_VEC_PATH = os.path.join(RAG_DIR, "embed_cache.f32")
+    ANN_PATH = os.path.join(RAG_DIR, "vectors.hnsw")
+    ALIVE_PATH = os.path.join(RAG_DIR, "alive.bits")  # tombstone bitmap over meta rows
     FILES_REG_PATH = os.path.join(RAG_DIR, "files_registry.json")
 
     # Answer quality settings
@@ -10,9 +10,10 @@ bp = Blueprint("rag_api", __name__)
 def rag_status():
     v_rows = int(0 if rag.V is None else rag.V.shape[0])
     meta_rows = int(len(rag.metas) if hasattr(rag, "metas") and rag.metas is not None else 0)
+    dead = meta_rows - rag.live_rows  # removed rows are kept until the next compaction
     return jsonify({
-        "chunks": v_rows,
-        "metas": meta_rows,
+        "chunks": v_rows - dead,
+        "metas": meta_rows - dead,
         "mismatch": (v_rows != meta_rows),
         "dim": Config.EMBED_DIM,
         "isIndexing": rag.is_indexing,
@@ -48,7 +49,7 @@ def rag_query():
         
         resp["_meta"] = {
             "isIndexing": rag.is_indexing,
-            "chunks": int(0 if rag.V is None else rag.V.shape[0]),
+            "chunks": rag.live_rows,
         }
         print(f"Query: {q[:50]}... | Answer length: {len(resp.get('answer', ''))}")
         return jsonify(resp)
@@ -1,8 +1,20 @@
+import asyncio
+import hashlib
 import html
+import inspect
+import io
+import json
+import re
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 import math
 import random
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+import numpy as np
+
 from ..config import Config
 from ..services.genai_service import ensure_genai_client  # <- use your existing Google GenAI client
 from typing import Tuple
@@ -21,14 +33,37 @@ DEFAULT_VOICE_B = "en-IN-PrabhatNeural"
 DEFAULT_RATE = "0%"              # -10%..+20% safe for most voices
 DEFAULT_PITCH = "0st"            # semitones (e.g., +2st)
 
-@dataclass
+# ---------- genai client ----------
+# Creating the client (auth, first TLS handshake) is otherwise paid inside the first
+# podcast request. With PODCAST_PREWARM=1 it is created in the background at import.
+_CLIENT = None
+_CLIENT_READY = threading.Event()
+
+def _prewarm_client():
+    global _CLIENT
+    try:
+        _CLIENT = ensure_genai_client()
+    except Exception as e:
+        print(f"[podcast] genai client prewarm failed: {e}")
+    finally:
+        _CLIENT_READY.set()
+
+def _get_client():
+    global _CLIENT
+    if Config.PODCAST_PREWARM:
+        _CLIENT_READY.wait(timeout=30)  # request arrived before the prewarm finished
+    if _CLIENT is None:
+        _CLIENT = ensure_genai_client()
+    return _CLIENT
+
+if Config.PODCAST_PREWARM:
+    threading.Thread(target=_prewarm_client, daemon=True).start()
+
+@dataclass(slots=True, frozen=True)
 class Turn:
     speaker: str  # "A" or "B"
     text: str
 
-def _sanitize(t: str) -> str:
-    return html.escape((t or "").strip())
-
 def _target_words(minutes: float) -> int:
     return max(120, int(minutes * WPM))
 
@@ -48,25 +83,45 @@ def _chunk_points(total_words: int) -> List[int]:
         sizes[-1] += diff
     return sizes
 
+# outline beats with a "{t}" topic slot, formatted per request
+_OUTLINE_TEMPLATES = (
+    ("Intro",        "Welcome! Today we’re unpacking {t}. Why it matters and where people stumble."),
+    ("Big Idea 1",   "First, the core idea behind {t}. What it is, in plain language."),
+    ("Big Idea 2",   "Second, a practical angle—how {t} shows up in real use."),
+    ("Example",      "A quick example so the idea of {t} sticks."),
+    ("Common Pitfall", "A common mistake when people work with {t}, and how to avoid it."),
+    ("Clarify",      "Let’s tidy up a subtle confusion people have around {t}."),
+    ("Tactics",      "Concrete steps to apply {t} the right way."),
+    ("Contrast",     "When {t} is not the right tool—and what to use instead."),
+    ("Mini Recap",   "Recap the essentials of {t} in a few beats."),
+    ("Outro",        "A short takeaway and where to go next to deepen {t}."),
+)
+
 def _seed_outline(topic: str) -> List[Tuple[str, str]]:
     t = topic.strip()
-    return [
-        ("Intro",        f"Welcome! Today we’re unpacking {t}. Why it matters and where people stumble."),
-        ("Big Idea 1",   f"First, the core idea behind {t}. What it is, in plain language."),
-        ("Big Idea 2",   f"Second, a practical angle—how {t} shows up in real use."),
-        ("Example",      f"A quick example so the idea of {t} sticks."),
-        ("Common Pitfall", f"A common mistake when people work with {t}, and how to avoid it."),
-        ("Clarify",      f"Let’s tidy up a subtle confusion people have around {t}."),
-        ("Tactics",      f"Concrete steps to apply {t} the right way."),
-        ("Contrast",     f"When {t} is not the right tool—and what to use instead."),
-        ("Mini Recap",   f"Recap the essentials of {t} in a few beats."),
-        ("Outro",        f"A short takeaway and where to go next to deepen {t}."),
-    ]
+    return [(h, tmpl.format(t=t)) for h, tmpl in _OUTLINE_TEMPLATES]
+
+def _budget_cuts(sizes: List[int], want: int) -> Tuple[int, int]:
+    """
+    Accumulate per-part word counts until `want` is reached.
+    Returns (index of the last part kept, words kept from that part); the last part
+    is trimmed to what is left of the budget, but never below 5 words.
+    """
+    wc = 0
+    n = 0
+    for i, n in enumerate(sizes):
+        if wc + n > want:
+            n = min(n, max(5, want - wc))
+        wc += n
+        if wc >= want:
+            return i, n
+    return len(sizes) - 1, n
 
 def _expand_outline_to_text(outline: List[Tuple[str, str]], total_words: int) -> List[str]:
     # naive expansion: distribute words and write tight lines
     chunks = _chunk_points(total_words)
     out_lines: List[str] = []
+    running_wc = 0
     i = 0
     for _, seed in outline:
         want = chunks[min(i, len(chunks)-1)]
@@ -79,22 +134,17 @@ def _expand_outline_to_text(outline: List[Tuple[str, str]], total_words: int) ->
             "Keep an eye on definitions so terms don’t drift.",
             "When in doubt, return to first principles.",
         ]
-        # stitch short sentences until we hit the word quota
-        acc: List[str] = []
-        wc = 0
-        for p in parts:
-            words = p.split()
-            if wc + len(words) > want:
-                # trim to fit
-                words = words[:max(5, want - wc)]
-            acc.append(" ".join(words))
-            wc += len(words)
-            if wc >= want:
-                break
+        # stitch short sentences until we hit the word quota (last one trimmed to fit)
+        split_parts = [p.split() for p in parts]
+        sizes = [len(w) for w in split_parts]
+        last, keep = _budget_cuts(sizes, want)
+        acc = [" ".join(w) for w in split_parts[:last]]
+        acc.append(" ".join(split_parts[last][:keep]))
         line = " ".join(acc)
         out_lines.append(line)
+        running_wc += sum(sizes[:last]) + keep
         i += 1
-        if sum(len(l.split()) for l in out_lines) >= total_words:
+        if running_wc >= total_words:
             break
     return out_lines
 
@@ -108,31 +158,84 @@ def _alternate_speakers(lines: List[str]) -> List[Turn]:
         turns.append(Turn(who, text))
         who = "B" if who == "A" else "A"
     return turns
+
+# drop control chars (except \t \n), map nbsp -> space; one C-level pass via str.translate
+_CTRL_TABLE = dict.fromkeys((i for i in range(0x20) if i not in (0x09, 0x0A)), None)
+_CTRL_TABLE[0xA0] = 0x20
+
 def _sanitize_for_ssml(s: str) -> str:
     # strip control chars (except \t \n), collapse spaces, escape XML
-    s = (s or "").replace("\u00A0", " ")  # nbsp -> space
-    s = "".join(ch for ch in s if ch in ("\t", "\n") or 0x20 <= ord(ch) <= 0x10FFFF)
-    s = " ".join(s.split())
-    return html.escape(s)
+    if not s:
+        return ""
+    return html.escape(" ".join(s.translate(_CTRL_TABLE).split()))
+
+_SSML_OPEN = '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="en-IN">'
+_SSML_CLOSE = '</speak>'
+_VOICE_OPEN_FMT = '<voice name="%s">'
+_BREAK_TAG = '<break time="%dms"/>' % int(BREAK_MS_BETWEEN_TURNS)
 
 def _to_ssml(turns: List[Turn],
              voice_a: str = DEFAULT_VOICE_A,
              voice_b: str = DEFAULT_VOICE_B,
-             rate: str = DEFAULT_RATE,     # kept for API compatibility (unused)
-             pitch: str = DEFAULT_PITCH):  # kept for API compatibility (unused)
-    parts = ['<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="en-IN">']
+             **_unused) -> str:  # rate/pitch are not applied in multi-voice SSML
+    # presized slots (header + 4 per turn + footer) filled by index, one join at the end
+    parts = [""] * (2 + 4 * len(turns))
+    parts[0] = _SSML_OPEN
+    open_a = _VOICE_OPEN_FMT % voice_a
+    open_b = _VOICE_OPEN_FMT % voice_b
+    last = len(turns) - 1
+    k = 1
     for i, t in enumerate(turns):
-        txt = _sanitize_for_ssml(t.text) if "_sanitize_for_ssml" in globals() else _sanitize(t.text)
+        txt = _sanitize_for_ssml(t.text)
+        if not txt:
+            continue
+        parts[k] = open_a if t.speaker == "A" else open_b
+        parts[k + 1] = txt  # <--- no <prosody> wrapper at all
+        if i < last:
+            parts[k + 2] = _BREAK_TAG  # pause stays INSIDE <voice>
+        parts[k + 3] = '</voice>'
+        k += 4
+    parts[k] = _SSML_CLOSE
+    return "".join(parts[:k + 1])
+
+def _stream_to_ssml(turns: Iterable[Turn],
+                    voice_a: str = DEFAULT_VOICE_A,
+                    voice_b: str = DEFAULT_VOICE_B,
+                    want_turns: bool = True) -> Tuple[str, List[Dict[str, str]], int]:
+    """
+    Single pass over `turns` (any iterable, e.g. a generator) that scrubs file
+    mentions, counts words and writes the SSML directly; only if asked does it
+    collect the scrubbed {"speaker","text"} dicts on the side.
+    Returns (ssml, turn_dicts, total_words).
+    """
+    buf = io.StringIO()
+    w = buf.write
+    w(_SSML_OPEN)
+    open_a = _VOICE_OPEN_FMT % voice_a
+    open_b = _VOICE_OPEN_FMT % voice_b
+    out_turns: List[Dict[str, str]] = []
+    words = 0
+    pending = False  # a <voice> is open and waits to learn whether another turn follows
+    for t in turns:
+        text = _scrub_file_mentions(t.text)
+        if want_turns:
+            out_turns.append({"speaker": t.speaker, "text": text})
+        if not text:
+            continue
+        words += text.count(" ") + 1  # scrubbing already collapsed whitespace to single spaces
+        txt = _sanitize_for_ssml(text)
         if not txt:
             continue
-        voice = voice_a if t.speaker == "A" else voice_b
-        parts.append(f'<voice name="{voice}">')
-        parts.append(txt)  # <--- no <prosody> wrapper at all
-        if i < len(turns) - 1:
-            parts.append(f'<break time="{int(BREAK_MS_BETWEEN_TURNS)}ms"/>')  # pause stays INSIDE <voice>
-        parts.append('</voice>')
-    parts.append('</speak>')
-    return "".join(parts)
+        if pending:
+            w(_BREAK_TAG)  # pause stays INSIDE the previous <voice>
+            w('</voice>')
+        w(open_a if t.speaker == "A" else open_b)
+        w(txt)
+        pending = True
+    if pending:
+        w('</voice>')
+    w(_SSML_CLOSE)
+    return buf.getvalue(), out_turns, words
 
 # Optional single-voice fallback if your region/voice combo dislikes multi-voice
 def _to_ssml_single_voice(turns: List[Turn],
@@ -142,9 +245,9 @@ def _to_ssml_single_voice(turns: List[Turn],
     # prefix with A:/B: so the dialog is clear even with one voice
     joined = " ".join(f"{t.speaker}: {_sanitize_for_ssml(t.text)}" for t in turns if (t.text or "").strip())
     return (
-        '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="en-IN">'
-        f'<voice name="{voice}"><prosody rate="{rate}" pitch="{pitch}">{joined}</prosody></voice>'
-        '</speak>'
+        _SSML_OPEN
+        + f'<voice name="{voice}"><prosody rate="{rate}" pitch="{pitch}">{joined}</prosody></voice>'
+        + _SSML_CLOSE
     )
 
 def build_transcript(
@@ -162,9 +265,10 @@ def build_transcript(
     lines = _expand_outline_to_text(outline, total_words)
     turns = _alternate_speakers(lines)
     # compute estimated duration
-    words = sum(len(t.text.split()) for t in turns)
+    counts = np.fromiter((len(t.text.split()) for t in turns), dtype=np.int32, count=len(turns))
+    words = int(counts.sum())
     est_sec = int(words / WPM * 60)
-    ssml = _to_ssml(turns, voice_a, voice_b, rate, pitch)
+    ssml = _to_ssml(turns, voice_a, voice_b)
     return {
         "topic": topic,
         "voices": {"A": voice_a, "B": voice_b},
@@ -176,13 +280,17 @@ def build_transcript(
     }
 
 def _words(s: str) -> int:
+    # str.split counts in C; a finditer scan avoids the list but is several times slower
     return len((s or "").split())
 
 def _shorten_by_words(s: str, max_w: int) -> str:
-    w = (s or "").split()
-    if len(w) <= max_w:
-        return s.strip()
-    return (" ".join(w[:max(5, max_w)]) + "…").strip()
+    # split only as far as needed: the remainder past `keep` words stays one string
+    s = (s or "").strip()
+    keep = max(5, max_w)
+    parts = s.split(None, keep)
+    if len(parts) <= max_w:
+        return s
+    return " ".join(parts[:keep]) + "…"
 
 def _first_sentence(s: str, fallback_words: int = 30) -> str:
     s = (s or "").strip().replace("\n", " ")
@@ -198,72 +306,64 @@ def _nice_pdf_name(pdf_name: str) -> str:
     # Replace underscores with spaces for better readability
     return name.replace("_", " ")
 
-def _context_block_for_llm(contexts: List[Dict[str, Any]], budget_chars: int = 1800) -> str:
-    used = 0
-    parts = []
-    for c in contexts:
-        t = (c.get("text") or "").strip()
-        # Remove file name from the tag - only keep rank and page info
-        # No file names shown to LLM, so no underscore issue here
-        tag = f"[Source {c.get('rank','?')}] Page {c.get('page')}:\n"
-        chunk = (tag + t + "\n\n")
-        if used + len(chunk) > budget_chars:
-            break
-        parts.append(chunk)
-        used += len(chunk)
-    return "".join(parts).strip()
-import re
+_RE_FILE = re.compile(r'\b[\w\-.]+\.(?:pdf|docx?|pptx?|xlsx)\b', re.I)
+_RE_BRACKET = re.compile(r'\[(?:source|doc|document|file)[^\]]*\]', re.I)
+_RE_GENERIC = re.compile(r'\b(?:document|file|source)\s*\d+\b', re.I)
+_RE_WS = re.compile(r'\s+')
 
 def _scrub_file_mentions(s: str) -> str:
     if not s:
         return s
     # remove explicit filenames like foo.pdf / bar.docx etc.
-    s = re.sub(r'\b[\w\-.]+\.(?:pdf|docx?|pptx?|xlsx)\b', 'the reference', s, flags=re.I)
+    s = _RE_FILE.sub('the reference', s)
     # remove [Source 1], [Doc: …], bracketed refs
-    s = re.sub(r'\[(?:source|doc|document|file)[^\]]*\]', '', s, flags=re.I)
+    s = _RE_BRACKET.sub('', s)
     # soften generic mentions like "from document 3", "per file 2"
-    s = re.sub(r'\b(?:document|file|source)\s*\d+\b', 'the reference', s, flags=re.I)
+    s = _RE_GENERIC.sub('the reference', s)
     # collapse leftover multiple spaces
-    return " ".join(s.split())
+    return _RE_WS.sub(' ', s).strip()
 
 def _summarize_context_points(contexts: List[Dict[str, Any]], max_points: int = 4) -> List[str]:
     pts = []
-    for c in (contexts or [])[:max_points]:
+    for c in islice(contexts or (), max_points):
         s = _first_sentence(c.get("text", ""), 28)
         if s:
             # DO NOT include doc names, pages, or "Source x" in the transcript
             pts.append(s)
     return pts
 
+# fallback phrasing pools for _compose_from_selection; openings take the selection via "{}"
+_OPENINGS = (
+    "So we came across this interesting point about {}...",
+    "There's something fascinating here about {}...",
+    "This caught our attention - {}...",
+    "We were reading about {} and found...",
+    "Here's an intriguing perspective on {}...",
+    "Let's dive into this idea about {}...",
+)
+_TRANSITIONS = (
+    "Here's what the sources tell us:",
+    "The documents reveal some key points:",
+    "Looking at the evidence, we find:",
+    "The research shows:",
+    "From what we've read:",
+)
+_ENDINGS = (
+    "The key takeaway here:",
+    "What this really means:",
+    "Bottom line:",
+    "To wrap this up:",
+    "The main insight:",
+)
+
 def _compose_from_selection(selection: str, context_points: List[str], target_words: int) -> List[str]:
-    # Randomize the fallback opening as well
-    import random
-    
-    openings = [
-        f"So we came across this interesting point about {selection[:50]}...",
-        f"There's something fascinating here about {selection[:50]}...", 
-        f"This caught our attention - {selection[:50]}...",
-        f"We were reading about {selection[:50]} and found...",
-        f"Here's an intriguing perspective on {selection[:50]}...",
-        f"Let's dive into this idea about {selection[:50]}...",
-    ]
-    
     blocks: List[str] = []
-    # Use random opening instead of always "You highlighted"
-    intro = random.choice(openings)
-    blocks.append(intro)
+    # Use random opening instead of always "You highlighted"; only the chosen template is formatted
+    blocks.append(random.choice(_OPENINGS).format(selection[:50]))
 
     if context_points:
-        transitions = [
-            "Here's what the sources tell us:",
-            "The documents reveal some key points:",
-            "Looking at the evidence, we find:",
-            "The research shows:",
-            "From what we've read:",
-        ]
-        blocks.append(random.choice(transitions))
-        for pt in context_points:
-            blocks.append(pt)
+        blocks.append(random.choice(_TRANSITIONS))
+        blocks.extend(context_points)
 
     blocks.append("How to apply it in practice, without overthinking:")
     blocks.append("Start from the exact wording, define the terms, then test it on a small example.")
@@ -274,27 +374,22 @@ def _compose_from_selection(selection: str, context_points: List[str], target_wo
     blocks.append("Quick checklist:")
     blocks.append("Definition clear? Source cited? Example concrete? Edge case noted? If yes, you're in good shape.")
 
-    endings = [
-        "The key takeaway here:",
-        "What this really means:",
-        "Bottom line:",
-        "To wrap this up:",
-        "The main insight:",
-    ]
-    blocks.append(random.choice(endings))
+    blocks.append(random.choice(_ENDINGS))
     blocks.append("Keep the claim anchored to sources; if contexts disagree, say so, then pick the scope that fits your use.")
 
     # Compact to target words by trimming each long line
-    out: List[str] = []
     want_turns = max(10, min(14, len(blocks)))
     per = max(18, int(target_words / want_turns))
+    out: List[str] = []
+    wc = 0
     for b in blocks:
         out.append(_shorten_by_words(b, per + 10))
-        if sum(_words(x) for x in out) >= target_words:
+        wc += _words(out[-1])
+        if wc >= target_words:
             break
     return out
 
-def build_transcript_from_selection(
+async def build_transcript_from_selection_async(
     selection: str,
     contexts: List[Dict[str, Any]],
     minutes: Optional[float] = None,
@@ -303,22 +398,23 @@ def build_transcript_from_selection(
     rate: str = DEFAULT_RATE,
     pitch: str = DEFAULT_PITCH,
     use_llm: bool = True,
+    want_turns: bool = True,
 ) -> Dict[str, Any]:
     m = float(minutes) if minutes else DEFAULT_MINUTES
     total_words = _target_words(m)
 
+    dialog_task = None
     if use_llm and contexts:
-        turns = _llm_dialog_from_selection(selection, contexts, total_words)
+        dialog = _llm_dialog_parallel if Config.PODCAST_PARALLEL_SECTIONS else _llm_dialog_from_selection
+        dialog_task = asyncio.create_task(dialog(selection, contexts, total_words))
+        # a new task only runs once we yield: let it reach its first request (or worker
+        # thread) so the manifest below is built while that is in flight
+        await asyncio.sleep(0)
     else:
         # existing rule-based composition
         points = _summarize_context_points(contexts, max_points=4)
         lines = _compose_from_selection(selection, points, total_words)
         turns = _alternate_speakers(lines)
-    turns = [Turn(t.speaker, _scrub_file_mentions(t.text)) for t in turns]
-
-    words = sum(len(t.text.split()) for t in turns)
-    est_sec = int(words / WPM * 60)
-    ssml = _to_ssml(turns, voice_a, voice_b, rate, pitch)
 
     # Use the updated _nice_pdf_name function in the manifest
     manifest = [
@@ -332,9 +428,16 @@ def build_transcript_from_selection(
         for c in (contexts or [])
     ]
 
+    if dialog_task is not None:
+        turns = await dialog_task
+
+    # one pass: scrub, count words, emit SSML; turn dicts only when the caller wants them
+    ssml, turn_dicts, words = _stream_to_ssml(turns, voice_a, voice_b, want_turns)
+    est_sec = int(words / WPM * 60)
+
     return {
         "selection": selection,
-        "turns": [{"speaker": t.speaker, "text": t.text} for t in turns],
+        "turns": turn_dicts,
         "estimated_seconds": est_sec,
         "ssml": ssml,
         "voices": {"A": voice_a, "B": voice_b},
@@ -343,6 +446,26 @@ def build_transcript_from_selection(
         "sources": manifest,
     }
 
+def build_transcript_from_selection(
+    selection: str,
+    contexts: List[Dict[str, Any]],
+    minutes: Optional[float] = None,
+    voice_a: str = DEFAULT_VOICE_A,
+    voice_b: str = DEFAULT_VOICE_B,
+    rate: str = DEFAULT_RATE,
+    pitch: str = DEFAULT_PITCH,
+    use_llm: bool = True,
+    want_turns: bool = True,
+) -> Dict[str, Any]:
+    # sync entry point for the Flask routes; must not be called from a running event loop
+    return asyncio.run(build_transcript_from_selection_async(
+        selection, contexts, minutes, voice_a, voice_b, rate, pitch, use_llm, want_turns,
+    ))
+
+
+# tags are emitted lowercase so near-identical contexts share a byte-identical prefix;
+# the chunk text itself is passed through as extracted
+_SOURCE_TAG_FMT = "[source %s] Page %s:\n"
 
 def _context_block_for_llm(contexts: List[Dict[str, Any]], budget_chars: int = 1800) -> str:
     used = 0
@@ -351,155 +474,451 @@ def _context_block_for_llm(contexts: List[Dict[str, Any]], budget_chars: int = 1
         t = (c.get("text") or "").strip()
         # Remove file name from the tag - only keep rank and page info
         # No file names shown to LLM, so no underscore issue here
-        tag = f"[Source {c.get('rank','?')}] Page {c.get('page')}:\n"
-        chunk = (tag + t + "\n\n")
-        if used + len(chunk) > budget_chars:
+        tag = _SOURCE_TAG_FMT % (str(c.get("rank", "?")).lower(), c.get("page"))
+        # check the budget before building anything for this context
+        projected = used + len(tag) + len(t) + 2
+        if projected > budget_chars:
             break
-        parts.append(chunk)
-        used += len(chunk)
-    return "".join(parts).strip()
-
-def _llm_dialog_from_selection(selection: str, contexts: List[Dict[str, Any]], target_words: int) -> List[Turn]:
+        parts.append(tag)
+        parts.append(t)
+        parts.append("\n\n")
+        used = projected
+    return _normalize_ctx("".join(parts).rstrip())
+
+_RE_TRAILING_WS = re.compile(r"[ \t]+$", re.M)
+
+def _normalize_ctx(ctx: str) -> str:
+    # byte-identical prefixes for near-identical contexts (provider prompt caching + _BEATS_CACHE)
+    return _RE_TRAILING_WS.sub("", ctx)
+
+_BEATS_SYS = (
+    "You are a careful analyst. From the provided context, extract only what is present. "
+    "Return STRICT JSON with keys: hook, claims, counterpoints, examples, tips, pitfalls, takeaway. "
+    "Format:\n"
+    "{\n"
+    '  "hook": "one-sentence hook",\n'
+    '  "claims": ["...", "..."],\n'
+    '  "counterpoints": ["...", "..."],\n'
+    '  "examples": ["...", "..."],\n'
+    '  "tips": ["...", "..."],\n'
+    '  "pitfalls": ["...", "..."],\n'
+    '  "takeaway": "one-sentence conclusion"\n'
+    "}\n"
+    "If something is not in the context, omit it rather than inventing it."
+)
+
+_SCRIPT_SYS = (
+    "Write a natural two-host conversation (A and B) in Indian English/neutral English. "
+    "Use only the provided BEATS; do not add facts. "
+    "NEVER mention or allude to files, documents, pages, PDFs, sources, citations, or numbers like 'Source 2'. "
+    "If such tokens appear in input, IGNORE them. "
+    "Keep turns short (~18–36 words). Vary rhythm a bit. Include a little tension, resolve it, and end with a crisp takeaway."
+)
+
+# sections rendered concurrently by _llm_dialog_parallel, in outline order
+_SECTIONS = (
+    ("Intro", "Open with the hook and frame why the topic matters."),
+    ("Big ideas", "Walk through the main claims, grounding them with the examples and tips."),
+    ("Pitfall", "Raise a counterpoint or common pitfall, create a little tension, then resolve it."),
+    ("Outro", "Close with the crisp takeaway in a couple of short lines."),
+)
+
+MAX_WORDS_PER_TURN = 36
+
+# ---------- LLM response caches ----------
+class _LruCache:
+    """Small thread-safe LRU for LLM outputs keyed by hashed prompt inputs."""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            val = self._data.get(key)
+            if val is not None:
+                self._data.move_to_end(key)
+            return val
+
+    def put(self, key, val):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = val
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+# step 1: (selection, context digest, max tokens) -> raw beats JSON text
+_BEATS_CACHE = _LruCache(Config.PODCAST_LLM_CACHE_SIZE)
+# step 2: (beats digest, want_turns, target-words bucket[, "sections"]) -> script text(s)
+_SCRIPT_CACHE = _LruCache(Config.PODCAST_LLM_CACHE_SIZE)
+
+class _SemanticBeatsCache:
     """
-    Two-step pipeline:
-    1) Extract compact 'beats' (claims, counterpoints, examples, tips, pitfalls, takeaway) strictly from context.
-    2) Render an A/B conversation from those beats with short, natural turns.
+    Last `maxsize` (selection embedding, context digest, beats JSON) entries in a ring
+    buffer; a lookup is one matrix-vector product over the stored unit vectors.
     """
-    client = ensure_genai_client()
-    from google.genai import types
-    ctx = _context_block_for_llm(contexts, budget_chars=1400)  # tighter, higher signal
-
-    # ---- STEP 1: extract beats as JSON ----
-    sys1 = (
-        "You are a careful analyst. From the provided context, extract only what is present. "
-        "Return STRICT JSON with keys: hook, claims, counterpoints, examples, tips, pitfalls, takeaway. "
-        "Format:\n"
-        "{\n"
-        '  "hook": "one-sentence hook",\n'
-        '  "claims": ["...", "..."],\n'
-        '  "counterpoints": ["...", "..."],\n'
-        '  "examples": ["...", "..."],\n'
-        '  "tips": ["...", "..."],\n'
-        '  "pitfalls": ["...", "..."],\n'
-        '  "takeaway": "one-sentence conclusion"\n'
-        "}\n"
-        "If something is not in the context, omit it rather than inventing it."
-    )
-    
+    def __init__(self, maxsize: int, threshold: float):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._M: Optional[np.ndarray] = None
+        self._ctx: List[str] = [""] * maxsize
+        self._raw: List[str] = [""] * maxsize
+        self._n = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def get(self, emb: np.ndarray, ctx_digest: str) -> Optional[str]:
+        with self._lock:
+            if not self._n or self._M is None or self._M.shape[1] != emb.shape[0]:
+                return None
+            scores = self._M[:self._n] @ emb
+            # only entries built from the same context block are candidates
+            for i in np.argsort(scores)[::-1]:
+                if scores[i] < self.threshold:
+                    return None
+                if self._ctx[i] == ctx_digest:
+                    return self._raw[i]
+            return None
+
+    def put(self, emb: np.ndarray, ctx_digest: str, raw: str):
+        with self._lock:
+            if self._M is None or self._M.shape[1] != emb.shape[0]:
+                self._M = np.zeros((self.maxsize, emb.shape[0]), dtype=np.float32)
+                self._n = self._next = 0
+            i = self._next
+            self._M[i] = emb
+            self._ctx[i] = ctx_digest
+            self._raw[i] = raw
+            self._next = (i + 1) % self.maxsize
+            self._n = min(self._n + 1, self.maxsize)
+
+_SEM_CACHE_SIZE = 128
+_SEM_BEATS_CACHE = _SemanticBeatsCache(_SEM_CACHE_SIZE, Config.PODCAST_SEMANTIC_THRESHOLD)
+
+def _selection_embedding(selection: str) -> Optional[np.ndarray]:
+    from .rag_service import embed_texts
+    try:
+        v = embed_texts([selection], Config.EMBED_MODEL, Config.EMBED_DIM,
+                        "SEMANTIC_SIMILARITY", cache_fp=None)[0]
+    except Exception:
+        return None  # the cache is an optimization; never fail the request over it
+    n = float(np.linalg.norm(v))
+    return v / n if n > 0 else None
+
+_BEATS_MAX_TOKENS = 800
+_SCRIPT_MAX_TOKENS = 1200
+
+def _digest(s: str) -> str:
+    return hashlib.blake2b(s.encode("utf-8"), digest_size=16).hexdigest()
+
+def _beats_key(selection: str, ctx: str) -> Tuple[str, str, int]:
+    return (" ".join(selection.lower().split()), _digest(ctx), _BEATS_MAX_TOKENS)
+
+def _script_key(beats_sheet: str, want_turns: int, target_words: int) -> Tuple[str, int, int]:
+    # ~25-word buckets so nearby durations share a script
+    return (_digest(beats_sheet), want_turns, target_words // 25)
+
+# Stable content (system rules, context, beats) goes first and the per-request TOPIC
+# last, so the provider's prefix cache survives a change of selection.
+def _beats_prompt(selection: str, ctx: str) -> str:
     user1 = (
-        f"TOPIC: {selection}\n\n"
         "CONTEXT (do not quote sources; never mention file names/pages/ids):\n"
         f"{ctx}\n\n"
+        f"TOPIC: {selection}\n\n"
         "Extract the beats as STRICT JSON only. No prose outside JSON."
     )
-    resp1 = client.models.generate_content(
-        model=Config.GEN_MODEL,
-        contents=f"{sys1}\n\n{user1}",
-        config=types.GenerateContentConfig(
-            temperature=0.35,          # quality > variety
-            top_p=0.8,
-            max_output_tokens=min(800, Config.MAX_OUTPUT_TOKENS_DEFAULT),
-        ),
+    return f"{_BEATS_SYS}\n\n{user1}"
+
+def _script_prompt(selection: str, beats_sheet: str, instructions: str) -> str:
+    user2 = (
+        f"BEATS (only use these):\n{beats_sheet}\n\n"
+        f"TOPIC: {selection}\n\n"
+        f"{instructions} After the last line, write a line containing only '{_SCRIPT_END}'."
+    )
+    return f"{_SCRIPT_SYS}\n\n{user2}"
+
+_STR_LIST = {"type": "ARRAY", "items": {"type": "STRING"}}
+_BEATS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "hook": {"type": "STRING"},
+        "claims": _STR_LIST,
+        "counterpoints": _STR_LIST,
+        "examples": _STR_LIST,
+        "tips": _STR_LIST,
+        "pitfalls": _STR_LIST,
+        "takeaway": {"type": "STRING"},
+    },
+}
+
+# the script prompt asks for a closing "End" line; generation stops right before it
+_SCRIPT_END = "End"
+
+def _beats_config(types):
+    return types.GenerateContentConfig(
+        temperature=0.35,          # quality > variety
+        top_p=0.8,
+        max_output_tokens=min(_BEATS_MAX_TOKENS, Config.MAX_OUTPUT_TOKENS_DEFAULT),
+        response_mime_type="application/json",
+        response_schema=_BEATS_SCHEMA,
     )
-    raw = (getattr(resp1, "text", "") or "").strip()
 
-    import json, re
-    def _json_from_text(t: str) -> dict:
-        # robustly parse JSON from plain text or ```json blocks
-        m = re.search(r"\{.*\}", t, re.S)
-        if not m:
+def _script_config(types):
+    return types.GenerateContentConfig(
+        temperature=0.45,          # lower = crisper structure
+        top_p=0.8,
+        max_output_tokens=min(_SCRIPT_MAX_TOKENS, Config.MAX_OUTPUT_TOKENS_DEFAULT),
+        stop_sequences=["\n" + _SCRIPT_END],
+    )
+
+def _json_from_text(t: str) -> dict:
+    # step 1 asks for JSON mode, so the body is usually the object itself; fall back to
+    # the outermost {...} for replies wrapped in ```json fences or prose
+    try:
+        obj = json.loads(t)
+    except Exception:
+        i, j = t.find("{"), t.rfind("}")
+        if i < 0 or j <= i:
             return {}
         try:
-            return json.loads(m.group(0))
+            obj = json.loads(t[i:j + 1])
         except Exception:
             return {}
+    return obj if isinstance(obj, dict) else {}
+
+def _parse_beats(raw: str) -> Dict[str, Any]:
+    beats = _json_from_text(raw)
+    return {
+        "hook":          beats.get("hook") or "",
+        "claims":        [s for s in (beats.get("claims") or []) if s.strip()],
+        "counterpoints": [s for s in (beats.get("counterpoints") or []) if s.strip()],
+        "examples":      [s for s in (beats.get("examples") or []) if s.strip()],
+        "tips":          [s for s in (beats.get("tips") or []) if s.strip()],
+        "pitfalls":      [s for s in (beats.get("pitfalls") or []) if s.strip()],
+        "takeaway":      beats.get("takeaway") or "",
+    }
+
+def _beats_usable(beats: Dict[str, Any]) -> bool:
+    return bool(beats["hook"] or beats["claims"] or beats["examples"] or beats["takeaway"])
+
+_BEATS_LISTS = (
+    ("Claims", "claims"),
+    ("Counterpoints", "counterpoints"),
+    ("Examples", "examples"),
+    ("Tips", "tips"),
+    ("Pitfalls", "pitfalls"),
+)
+
+def _iter_beats(beats: Dict[str, Any]) -> Iterable[str]:
+    # one line per yield; "" marks the blank line between sections
+    hook, takeaway = beats["hook"], beats["takeaway"]
+    if hook:
+        yield f"Hook: {hook}"
+        yield ""
+    for label, key in _BEATS_LISTS:
+        yield label + ":"
+        items = beats[key]
+        if items:
+            for it in items:
+                yield f"- {it}"
+        else:
+            yield "-"
+        yield ""
+    if takeaway:
+        yield f"Takeaway: {takeaway}"
+
+def _beats_sheet(beats: Dict[str, Any]) -> str:
+    # Build a compact beat sheet for the model in a single join
+    return "\n".join(_iter_beats(beats)).rstrip("\n")
+
+_RE_SPEAKER = re.compile(r"^[ \t]*([AB]):[ \t]*(.+?)\s*$", re.M)
+
+def _cap_words(msg: str, max_words: int) -> str:
+    parts = msg.split(None, max_words)
+    if len(parts) > max_words:
+        return " ".join(parts[:max_words]) + "…"
+    return msg
+
+def _parse_dialog(text: str, max_words_per_turn: int = MAX_WORDS_PER_TURN) -> List[Turn]:
+    # parse tagged lines to turns and enforce word caps
+    turns = [
+        Turn(m.group(1), _cap_words(m.group(2), max_words_per_turn))
+        for m in _RE_SPEAKER.finditer(text)
+    ]
+    if turns:
+        return turns
+    # recover: no speaker tags at all, so alternate A/B over the lines
+    lines = (_cap_words(ln.strip(), max_words_per_turn) for ln in text.splitlines())
+    return _alternate_speakers(lines)
+
+def _fallback_dialog(selection: str, contexts: List[Dict[str, Any]], target_words: int) -> List[Turn]:
+    points = _summarize_context_points(contexts, max_points=4)
+    lines = _compose_from_selection(selection, points, target_words)
+    return _alternate_speakers(lines)
+
+async def _extract_beats(client, types, selection: str, ctx: str) -> Optional[Dict[str, Any]]:
+    """
+    Step 1 with caching: exact (selection, context) hits first, then, if enabled, a
+    near-duplicate selection over the same context. Returns None if the beats are unusable.
+    """
+    beats_key = _beats_key(selection, ctx)
+    raw = _BEATS_CACHE.get(beats_key)
+    emb = None
+    if raw is None and Config.PODCAST_SEMANTIC_CACHE:
+        emb = await asyncio.to_thread(_selection_embedding, selection)
+        if emb is not None:
+            raw = _SEM_BEATS_CACHE.get(emb, beats_key[1])
+            if raw is not None:
+                emb = None  # already stored under a neighbouring selection
+    if raw is None:
+        resp1 = await client.aio.models.generate_content(
+            model=Config.GEN_MODEL,
+            contents=_beats_prompt(selection, ctx),
+            config=_beats_config(types),
+        )
+        raw = (getattr(resp1, "text", "") or "").strip()
+    beats = _parse_beats(raw)
+    if not _beats_usable(beats):
+        return None
+    _BEATS_CACHE.put(beats_key, raw)
+    if emb is not None:
+        _SEM_BEATS_CACHE.put(emb, beats_key[1], raw)
+    return beats
+
+async def _stream_script(client, types, contents: str, max_lines: int) -> str:
+    """
+    Stream the step-2 script and stop pulling tokens once `max_lines` complete
+    speaker-tagged lines have arrived; anything the model writes past them is dropped.
+    """
+    stream = client.aio.models.generate_content_stream(
+        model=Config.GEN_MODEL,
+        contents=contents,
+        config=_script_config(types),
+    )
+    if inspect.isawaitable(stream):  # newer google-genai returns an awaitable iterator
+        stream = await stream
+    done: List[str] = []
+    tail = ""
+    n_lines = 0
+    async for chunk in stream:
+        tail += getattr(chunk, "text", "") or ""
+        cut = tail.rfind("\n")
+        if cut < 0:
+            continue
+        block, tail = tail[:cut + 1], tail[cut + 1:]
+        for ln in block.splitlines():
+            if ln.strip():
+                done.append(ln)
+                # preamble and fences don't count: _parse_dialog drops them once tags exist
+                if _RE_SPEAKER.match(ln):
+                    n_lines += 1
+                if n_lines >= max_lines:
+                    break
+        if n_lines >= max_lines:
+            tail = ""
+            break
+    aclose = getattr(stream, "aclose", None)
+    if aclose is not None:
+        await aclose()
+    done.append(tail)
+    return "\n".join(done).strip()
+
+async def _llm_dialog_from_selection(selection: str, contexts: List[Dict[str, Any]], target_words: int) -> List[Turn]:
+    """
+    Two-step pipeline:
+    1) Extract compact 'beats' (claims, counterpoints, examples, tips, pitfalls, takeaway) strictly from context.
+    2) Render an A/B conversation from those beats with short, natural turns (streamed).
+    """
+    client = _get_client()
+    from google.genai import types
+    ctx = _context_block_for_llm(contexts, budget_chars=1400)  # tighter, higher signal
 
-    beats = _json_from_text(raw) or {}
-    hook         = beats.get("hook") or ""
-    claims       = [s for s in (beats.get("claims") or []) if s.strip()]
-    counter      = [s for s in (beats.get("counterpoints") or []) if s.strip()]
-    examples     = [s for s in (beats.get("examples") or []) if s.strip()]
-    tips         = [s for s in (beats.get("tips") or []) if s.strip()]
-    pitfalls     = [s for s in (beats.get("pitfalls") or []) if s.strip()]
-    takeaway     = beats.get("takeaway") or ""
+    # ---- STEP 1: extract beats as JSON ----
+    beats = await _extract_beats(client, types, selection, ctx)
 
     # fallback if step 1 failed
-    if not (hook or claims or examples or takeaway):
-        points = _summarize_context_points(contexts, max_points=4)
-        lines = _compose_from_selection(selection, points, target_words)
-        return _alternate_speakers(lines)
+    if beats is None:
+        return _fallback_dialog(selection, contexts, target_words)
 
     # ---- STEP 2: render script from beats ----
     # hard limits for turn sizes to keep it snappy
     want_turns = max(10, min(14, target_words // 22))
-    max_words_per_turn = 36
-
-    sys2 = (
-        "Write a natural two-host conversation (A and B) in Indian English/neutral English. "
-        "Use only the provided BEATS; do not add facts. "
-        "NEVER mention or allude to files, documents, pages, PDFs, sources, citations, or numbers like 'Source 2'. "
-        "If such tokens appear in input, IGNORE them. "
-        "Keep turns short (~18–36 words). Vary rhythm a bit. Include a little tension, resolve it, and end with a crisp takeaway."
-    )
-    # Build a compact beat sheet for the model
-    def _join(label, items):
-        return f"{label}:\n" + ("\n".join(f"- {i}" for i in items) if items else "-")
-
-    beats_sheet = "\n\n".join(filter(None, [
-        f"Hook: {hook}" if hook else "",
-        _join("Claims", claims),
-        _join("Counterpoints", counter),
-        _join("Examples", examples),
-        _join("Tips", tips),
-        _join("Pitfalls", pitfalls),
-        f"Takeaway: {takeaway}" if takeaway else "",
-    ]))
+    beats_sheet = _beats_sheet(beats)
+
+    script_key = _script_key(beats_sheet, want_turns, target_words)
+    text = _SCRIPT_CACHE.get(script_key)
+    if text is None:
+        prompt = _script_prompt(
+            selection, beats_sheet,
+            f"Target total words: ~{target_words}. "
+            f"Write exactly {want_turns} lines, each starting with 'A:' or 'B:'.",
+        )
+        text = await _stream_script(client, types, prompt, want_turns)
+    turns = _parse_dialog(text)
 
-    user2 = (
-        f"TOPIC: {selection}\n\n"
-        f"BEATS (only use these):\n{beats_sheet}\n\n"
-        f"Target total words: ~{target_words}. "
-        f"Write exactly {want_turns} lines, each starting with 'A:' or 'B:'."
-    )
+    # strict fallback if model returned junk
+    if not turns:
+        return _fallback_dialog(selection, contexts, target_words)
+    _SCRIPT_CACHE.put(script_key, text)
+    # file-mention scrubbing happens once, in the caller's _stream_to_ssml pass
+    return turns
 
-    resp2 = client.models.generate_content(
-        model=Config.GEN_MODEL,
-        contents=f"{sys2}\n\n{user2}",
-        config=types.GenerateContentConfig(
-            temperature=0.45,          # lower = crisper structure
-            top_p=0.8,
-            max_output_tokens=min(1200, Config.MAX_OUTPUT_TOKENS_DEFAULT),
-        ),
-    )
-    text = (getattr(resp2, "text", "") or "").strip()
+async def _llm_dialog_parallel(selection: str, contexts: List[Dict[str, Any]], target_words: int) -> List[Turn]:
+    """
+    Same beats extraction as _llm_dialog_from_selection, but step 2 is split into one
+    prompt per outline section and the sections are generated concurrently, so the
+    wall-clock cost of rendering is the slowest section rather than the whole script.
+    """
+    client = _get_client()
+    from google.genai import types
+    ctx = _context_block_for_llm(contexts, budget_chars=1400)
+
+    beats = await _extract_beats(client, types, selection, ctx)
+    if beats is None:
+        return _fallback_dialog(selection, contexts, target_words)
 
-    # parse to turns and enforce word caps
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    want_turns = max(10, min(14, target_words // 22))
+    beats_sheet = _beats_sheet(beats)
+
+    script_key = _script_key(beats_sheet, want_turns, target_words) + ("sections",)
+    texts = _SCRIPT_CACHE.get(script_key)
+    if texts is not None:
+        return [t for text in texts for t in _parse_dialog(text)]
+
+    # split the turn budget across sections; each section knows who speaks first so
+    # the concatenated script keeps alternating A/B across section boundaries
+    k = len(_SECTIONS)
+    base, extra = divmod(want_turns, k)
+    prompts = []
+    offset = 0
+    for i, (name, brief) in enumerate(_SECTIONS):
+        n_lines = base + (1 if i < extra else 0)
+        first = "A" if offset % 2 == 0 else "B"
+        offset += n_lines
+        prompts.append(_script_prompt(
+            selection, beats_sheet,
+            f"Write ONLY the '{name}' section of the episode: {brief} "
+            f"Target words for this section: ~{max(20, target_words * n_lines // want_turns)}. "
+            f"Write exactly {n_lines} lines, alternating speakers, starting with '{first}:'.",
+        ))
+
+    resps = await asyncio.gather(*[
+        client.aio.models.generate_content(
+            model=Config.GEN_MODEL,
+            contents=p,
+            config=_script_config(types),
+        )
+        for p in prompts
+    ])
+
+    texts = tuple((getattr(r, "text", "") or "").strip() for r in resps)
     turns: List[Turn] = []
-    who = "A"
-    for ln in lines:
-        if ln.startswith("A:"):
-            msg = ln[2:].strip()
-            who = "B"
-        elif ln.startswith("B:"):
-            msg = ln[2:].strip()
-            who = "A"
-        else:
-            # recover: alternate speakers if tag is missing
-            msg = ln
-            who = "B" if who == "A" else "A"
-        # cap overly long lines
-        words = msg.split()
-        if len(words) > max_words_per_turn:
-            msg = " ".join(words[:max_words_per_turn]) + "…"
-        turns.append(Turn("A" if who == "B" else "B", msg))
+    for text in texts:
+        turns.extend(_parse_dialog(text))
 
-    # strict fallback if model returned junk
     if not turns:
-        points = _summarize_context_points(contexts, max_points=4)
-        lines = _compose_from_selection(selection, points, target_words)
-        return _alternate_speakers(lines)
-    turns = [Turn(t.speaker, _scrub_file_mentions(t.text)) for t in turns]
-
+        return _fallback_dialog(selection, contexts, target_words)
+    _SCRIPT_CACHE.put(script_key, texts)
     return turns
-
@@ -1,50 +1,202 @@
 import os
-import glob
+import bisect
+import gc
+import hashlib
 import json
-import uuid
+import multiprocessing
 import time
 import threading
-from typing import List, Dict, Any, Tuple, Optional
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import accumulate
+from typing import List, Dict, Any, Tuple, Optional, Callable
 import logging
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 import numpy as np
 import fitz
 
+try:
+    import numba
+    from numba import njit, prange
+    if not (os.getenv("NUMBA_THREADING_LAYER") or os.getenv("NUMBA_THREADING_LAYER_PRIORITY")):
+        # kernels launch from request threads; after that TBB hangs interpreter exit, OpenMP doesn't
+        numba.config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+    _HAS_NUMBA = True
+except Exception:
+    _HAS_NUMBA = False
+
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    _HAS_ORJSON = False
+
+try:
+    import hnswlib
+    _HAS_HNSWLIB = True
+except Exception:
+    _HAS_HNSWLIB = False
+
+try:
+    import fcntl  # POSIX: the embed cache is shared between worker processes
+    _HAS_FCNTL = True
+except Exception:
+    _HAS_FCNTL = False
+
 from ..config import Config
-from .genai_service import ensure_genai_client, RpsLimiter, with_retry
+from .genai_service import ensure_genai_client, RpsLimiter, with_retry, types as _genai_types
+
+# ---- jsonl helpers (orjson when available)
+def _json_line(obj: Any) -> bytes:
+    if _HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+def _read_jsonl(fp: str) -> List[Any]:
+    # one read, then split; empty lines are skipped (the parsers accept stray whitespace)
+    with open(fp, "rb") as f:
+        data = f.read()
+    loads = orjson.loads if _HAS_ORJSON else json.loads
+    # these are acyclic dicts, so cyclic-GC passes triggered by the allocations are wasted
+    gc_was_on = gc.isenabled()
+    gc.disable()
+    try:
+        return [loads(line) for line in data.split(b"\n") if line and not line.isspace()]
+    finally:
+        if gc_was_on:
+            gc.enable()
+
+def _read_json(fp: str) -> Any:
+    with open(fp, "rb") as f:
+        data = f.read()
+    return orjson.loads(data) if _HAS_ORJSON else json.loads(data)
+
+def _write_json(fp: str, obj: Any):
+    # indented for humans poking at rag_index/ and uploads/
+    if _HAS_ORJSON:
+        data = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    with open(fp, "wb") as f:
+        f.write(data)
 
 # ---- math helpers
+def _l2norm_rows_py(M):
+    for i in prange(M.shape[0]):
+        s = np.float32(0.0)
+        for j in range(M.shape[1]):
+            s += M[i, j] * M[i, j]
+        inv = np.float32(1.0) / max(np.sqrt(s), np.float32(1e-12))
+        for j in range(M.shape[1]):
+            M[i, j] *= inv
+
+if _HAS_NUMBA:
+    _l2norm_rows_nb = njit(parallel=True, fastmath=True, cache=True)(_l2norm_rows_py)
+else:
+    _l2norm_rows_nb = None
+
 def l2norm_rows(M: np.ndarray) -> np.ndarray:
-    n = np.linalg.norm(M, axis=1, keepdims=True)
-    n = np.maximum(n, 1e-12)
-    return M / n
+    if _l2norm_rows_nb is not None and M.shape[0] >= 64 and M.dtype == np.float32 and M.flags.c_contiguous:
+        # single pass per row while it is still in cache; small batches skip the thread fan-out
+        _l2norm_rows_nb(M)
+        return M
+    # in place: one fused squared-sum pass, then a row-wise multiply by the reciprocal norm
+    sq = np.einsum("ij,ij->i", M, M)
+    np.sqrt(sq, out=sq)
+    np.maximum(sq, 1e-12, out=sq)
+    np.reciprocal(sq, out=sq)
+    M *= sq[:, None]
+    return M
+
+def l2norm_vec(v: np.ndarray) -> np.ndarray:
+    v *= 1.0 / (np.sqrt(v @ v) + 1e-12)
+    return v
+
+def _aligned_empty(shape, dtype, align: int = 64) -> np.ndarray:
+    """np.empty with an `align`-byte aligned data pointer, for full-width SIMD loads."""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    raw = np.empty(nbytes + align, dtype=np.uint8)
+    off = -raw.ctypes.data % align
+    return raw[off:off + nbytes].view(dtype).reshape(shape)
+
+def quantize_int8(V: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: V ~= Vq * scales[:, None]."""
+    scales = np.abs(V).max(axis=1) / 127.0
+    np.maximum(scales, 1e-12, out=scales)
+    Vq = np.rint(V / scales[:, None]).astype(np.int8)
+    return Vq, scales.astype(np.float32)
+
+def _int8_scores_py(Vq, scales, q, q_scale, out):
+    n, d = Vq.shape
+    for i in prange(n):
+        acc = 0
+        for j in range(d):
+            acc += np.int32(Vq[i, j]) * np.int32(q[j])
+        out[i] = acc * scales[i] * q_scale
+
+if _HAS_NUMBA:
+    _int8_scores = njit(parallel=True, cache=True)(_int8_scores_py)
+else:
+    _int8_scores = None
+
+_SCORE_BLOCK = 1 << 24  # float32 scores per batched GEMM block (64 MB)
+
+def _top_k(sims: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices and scores of the k largest entries, best first."""
+    n = sims.shape[0]
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    part = np.argpartition(sims, n-k)[n-k:]  # unsorted top-k, no negated copy
+    idxs = part[np.argsort(sims[part])[::-1]]
+    return idxs, sims[idxs]
+
+_NO_ROWS = np.empty(0, dtype=np.int64)
+
+def _mark_dead(index, rows) -> None:
+    """Hide rows from an HNSW graph's results."""
+    for i in rows:
+        try:
+            index.mark_deleted(int(i))
+        except RuntimeError:
+            pass  # already marked (saved graphs keep their marks)
 
-def chunk_text(txt: str, max_chars: int, overlap: int):
+def chunk_text(txt: str, max_chars: int, overlap: int, keep_chars: Optional[int] = None):
+    # keep_chars caps the text copied per chunk; (start, end) still describe the full window
     txt = txt or ""
     n = len(txt)
     if n == 0:
         return []
-    out, i = [], 0
-    while i < n:
-        j = min(n, i + max_chars)
-        out.append((txt[i:j], i, j))
-        if j == n:
-            break
-        i = max(0, j - overlap)
-    return out
-
-def extract_pdf_chunks(pdf_path: str) -> List[Dict[str, Any]]:
+    keep = min(keep_chars or max_chars, max_chars)
+    # windows start every `step` chars; the last one is the first that reaches the end
+    step = max(1, max_chars - overlap)
+    last = max(0, -(-(n - max_chars) // step))
+    return [(txt[i:i + keep], i, min(n, i + max_chars)) for i in range(0, last * step + 1, step)]
+
+def _chunk_id(pdf_path: str, page: int, start: int) -> str:
+    # deterministic: re-indexing the same file yields the same ids
+    return hashlib.sha1(f"{pdf_path}:{page}:{start}".encode("utf-8")).hexdigest()
+
+def extract_pdf_chunks(pdf_path: str, pages: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
+    """Chunk every page of the PDF, or only the 0-based [lo, hi) range in `pages`."""
     rows: List[Dict[str, Any]] = []
+    abs_path = os.path.abspath(pdf_path)
+    base_name = os.path.basename(pdf_path)
     try:
         doc = fitz.open(pdf_path)
-        for page_idx, page in enumerate(doc):
-            text = page.get_text("text", sort=True)
-            for ch, s, e in chunk_text(text, Config.CHUNK_CHARS, Config.CHUNK_OVERLAP):
-                ch = ch[:Config.CTX_SNIPPET_CHARS]
+        lo, hi = pages or (0, doc.page_count)
+        for page_idx in range(lo, min(hi, doc.page_count)):
+            page = doc.load_page(page_idx)
+            # unsorted text blocks: the chunker ignores layout, so skip the reading-order sort
+            text = "".join(b[4] for b in page.get_text("blocks") if b[6] == 0)
+            for ch, s, e in chunk_text(text, Config.CHUNK_CHARS, Config.CHUNK_OVERLAP,
+                                       keep_chars=Config.CTX_SNIPPET_CHARS):
                 rows.append({
-                    "id": str(uuid.uuid4()),
-                    "pdf_path": os.path.abspath(pdf_path),
-                    "pdf_name": os.path.basename(pdf_path),
+                    "id": _chunk_id(abs_path, page_idx + 1, s),
+                    "pdf_path": abs_path,
+                    "pdf_name": base_name,
                     "page": page_idx + 1,
                     "start": int(s),
                     "end": int(e),
@@ -55,9 +207,53 @@ def extract_pdf_chunks(pdf_path: str) -> List[Dict[str, Any]]:
         print(f"[WARN] Failed {pdf_path}: {ex}")
     return rows
 
-def _get_top_k():
-    # Prefer Config.TOP_SNIPPETS_PER_PDF, else env, else 8
-    return int(getattr(Config, "TOP_SNIPPETS_PER_PDF", os.getenv("TOP_SNIPPETS_PER_PDF", 8)))
+def _page_counts(pdf_paths: List[str]) -> List[int]:
+    counts = []
+    for p in pdf_paths:
+        try:
+            with fitz.open(p) as doc:
+                counts.append(doc.page_count)
+        except Exception:
+            counts.append(0)  # let extraction report the failure
+    return counts
+
+def _page_spans(pdf_paths: List[str], counts: List[int], workers: int) -> List[Tuple[str, Optional[Tuple[int, int]]]]:
+    """Extraction tasks; with fewer PDFs than workers, large PDFs are split into page ranges."""
+    if len(pdf_paths) >= workers:
+        return [(p, None) for p in pdf_paths]
+    span = max(16, -(-sum(counts) // workers))  # ceil; small ranges aren't worth a reopen
+    tasks: List[Tuple[str, Optional[Tuple[int, int]]]] = []
+    for p, n in zip(pdf_paths, counts):
+        if n <= span:
+            tasks.append((p, None))
+        else:
+            tasks.extend((p, (lo, lo + span)) for lo in range(0, n, span))
+    return tasks
+
+_extract_pool: Optional[ProcessPoolExecutor] = None
+_extract_pool_lock = threading.Lock()
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    # one pool for the process lifetime: each spawned worker re-imports the app, which
+    # costs seconds, so it is only worth paying once
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # spawn, not fork: indexing runs on a background thread while request threads
+            # may hold fitz/stdio locks that a forked child would inherit
+            ctx = multiprocessing.get_context("spawn")
+            _extract_pool = ProcessPoolExecutor(max_workers=Config.PDF_EXTRACT_WORKERS, mp_context=ctx)
+        return _extract_pool
+
+def _drop_extract_pool(pool: ProcessPoolExecutor) -> None:
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is pool:
+            _extract_pool = None
+    pool.shutdown(wait=False)
+
+# Prefer Config.TOP_SNIPPETS_PER_PDF, else env, else 8
+_TOP_K = int(getattr(Config, "TOP_SNIPPETS_PER_PDF", os.getenv("TOP_SNIPPETS_PER_PDF", 8)))
 
 def _get_slm_model():
     # Prefer a small/cheap model for snippet selection; fallback to GEN_MODEL
@@ -69,154 +265,440 @@ def _topsnips_sidecar_path(pdf_path: str) -> str:
     return os.path.join(Config.UPLOAD_DIR, f"{base}.topsnips.json")
 
 # ---- cache helpers
-import hashlib
 def _hash_text(t: str) -> str:
+    # the embed-cache sidecar is keyed on these digests, so changing the hash orphans it;
+    # SHA-1 is also the fastest hashlib digest on SHA-NI hardware (~1us per chunk)
     return hashlib.sha1((t or "").encode("utf-8")).hexdigest()
 
-def load_embed_cache(cache_fp: str) -> Dict[str, List[float]]:
-    cache = {}
-    if os.path.exists(cache_fp):
-        with open(cache_fp, "r", encoding="utf-8") as f:
+class EmbedCache:
+    """
+    Embedding cache as a raw float32 matrix (memory-mapped, grown geometrically) plus an
+    append-only sidecar holding a "dim=D" header and one text hash per row, in row order.
+    """
+    def __init__(self, vec_path: str, dim: int, legacy_jsonl: Optional[str] = None):
+        self.vec_path = vec_path
+        self.idx_path = os.path.splitext(vec_path)[0] + ".idx"
+        self.dim = dim
+        self.lock = threading.Lock()
+        self.rows: Dict[str, int] = {}
+        self.n = 0
+        self.vecs: Optional[np.memmap] = None
+        self._idx_off = 0  # bytes of the sidecar already folded into self.rows
+        with self._file_lock():
+            self._load()
+            if not self.rows and legacy_jsonl and os.path.exists(legacy_jsonl):
+                self._import_jsonl(legacy_jsonl)
+        self.mtime = self._idx_mtime()
+
+    @contextmanager
+    def _file_lock(self):
+        # exclusive across processes; held while the files are read into or written from
+        # this instance, so row offsets always come from the files, not a stale self.n
+        if not _HAS_FCNTL:
+            yield
+            return
+        fd = os.open(self.vec_path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _idx_mtime(self) -> float:
+        try:
+            return os.path.getmtime(self.idx_path)
+        except OSError:
+            return 0.0
+
+    def is_stale(self) -> bool:
+        # another process wrote the sidecar since we last read or wrote it
+        return self._idx_mtime() != self.mtime
+
+    def _vec_cap(self) -> int:
+        return os.path.getsize(self.vec_path) // (4 * self.dim) if os.path.exists(self.vec_path) else 0
+
+    def _read_idx_tail(self, f) -> Tuple[List[str], int]:
+        # complete lines only: a writer may be mid-append
+        data = f.read()
+        cut = data.rfind(b"\n") + 1
+        return data[:cut].decode("ascii").split(), cut
+
+    def _load(self):
+        hashes: List[str] = []
+        off = 0
+        if os.path.exists(self.idx_path):
+            with open(self.idx_path, "rb") as f:
+                header = f.readline()
+                if header.strip() == f"dim={self.dim}".encode():
+                    hashes, cut = self._read_idx_tail(f)
+                    off = len(header) + cut
+        cap = self._vec_cap()
+        if len(hashes) > cap:
+            # a hash whose vector never reached the file (interrupted write) is dropped
+            hashes = hashes[:cap]
+            self._truncate_idx(hashes)
+            off = os.path.getsize(self.idx_path)
+        if not hashes:
+            self._reset()
+            return
+        self.rows = {h: i for i, h in enumerate(hashes)}
+        self.n = len(hashes)
+        self._idx_off = off
+        self.vecs = np.memmap(self.vec_path, dtype=np.float32, mode="r+", shape=(cap, self.dim))
+
+    def _truncate_idx(self, hashes: List[str]):
+        with open(self.idx_path, "w", encoding="utf-8") as f:
+            f.write(f"dim={self.dim}\n" + "".join(h + "\n" for h in hashes))
+
+    def refresh(self) -> bool:
+        """Fold in rows another process appended; False if the cache must be reopened."""
+        with self.lock, self._file_lock():
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> bool:
+        try:
+            if os.path.getsize(self.idx_path) < self._idx_off or self._idx_off == 0:
+                return False  # reset or rewritten underneath us
+            with open(self.idx_path, "rb") as f:
+                f.seek(self._idx_off)
+                fresh, cut = self._read_idx_tail(f)
+        except OSError:
+            return False
+        cap = self._vec_cap()
+        if self.n + len(fresh) > cap:
+            return False
+        if cap and (self.vecs is None or self.vecs.shape[0] != cap):
+            self.vecs = np.memmap(self.vec_path, dtype=np.float32, mode="r+", shape=(cap, self.dim))
+        for j, h in enumerate(fresh):
+            self.rows[h] = self.n + j
+        self.n += len(fresh)
+        self._idx_off += cut
+        self.mtime = self._idx_mtime()
+        return True
+
+    def _reset(self):
+        self.rows, self.n, self.vecs = {}, 0, None
+        self._truncate_idx([])
+        self._idx_off = os.path.getsize(self.idx_path)
+        open(self.vec_path, "wb").close()
+
+    def _import_jsonl(self, fp: str):
+        # one-time migration from the old {"h":..., "v":[...]} per-line format
+        items = []
+        with open(fp, "r", encoding="utf-8") as f:
             for line in f:
                 try:
                     row = json.loads(line)
                     h, v = row.get("h"), row.get("v")
-                    if isinstance(h, str) and isinstance(v, list):
-                        cache[h] = v
+                    if isinstance(h, str) and isinstance(v, list) and len(v) == self.dim:
+                        items.append((h, np.asarray(v, dtype=np.float32)))
                 except Exception:
                     continue
-    return cache
-
-def append_embed_cache(cache_fp: str, items: List[Tuple[str, List[float]]]):
-    if not items:
-        return
-    with open(cache_fp, "a", encoding="utf-8") as f:
-        for h, v in items:
-            f.write(json.dumps({"h": h, "v": v}) + "\n")
-
-# --- Hybrid query knobs ---
-def _chat_conf_threshold() -> float:
-    try:
-        # Prefer Config.CHAT_CONF_THRESHOLD, else env, else 0.35
-        return float(getattr(Config, "CHAT_CONF_THRESHOLD", os.getenv("CHAT_CONF_THRESHOLD", 0.35)))
-    except Exception:
-        return 0.35
+        self._append_locked(items)
+
+    def _reserve(self, n_rows: int):
+        # sized from the file, never below it: another process may have grown it already
+        cap = self._vec_cap()
+        if n_rows > cap:
+            cap = max(n_rows, 2 * cap, 1024)
+            if self.vecs is not None:
+                self.vecs.flush()
+                self.vecs = None  # drop the old mapping before resizing the file
+            os.truncate(self.vec_path, cap * self.dim * 4)
+        if self.vecs is None or self.vecs.shape[0] != cap:
+            self.vecs = np.memmap(self.vec_path, dtype=np.float32, mode="r+", shape=(cap, self.dim))
+
+    def lookup(self, hashes: List[str], out: np.ndarray) -> List[int]:
+        """Copy the cached row into `out[i]` for every hit; returns the positions that missed."""
+        hit_pos, hit_rows, miss = [], [], []
+        with self.lock:
+            for i, h in enumerate(hashes):
+                r = self.rows.get(h)
+                if r is None:
+                    miss.append(i)
+                else:
+                    hit_pos.append(i)
+                    hit_rows.append(r)
+            if hit_pos:
+                out[hit_pos] = self.vecs[hit_rows]
+        return miss
+
+    def append(self, items: List[Tuple[str, np.ndarray]]):
+        with self.lock, self._file_lock():
+            # catch up with the files first: new rows go after every row already on disk
+            if not self._refresh_locked():
+                self._load()
+            self._append_locked(items)
+
+    def _append_locked(self, items: List[Tuple[str, np.ndarray]]):
+        fresh = {h: v for h, v in items if h not in self.rows}
+        if not fresh:
+            return
+        start, k = self.n, len(fresh)
+        self._reserve(start + k)
+        self.vecs[start:start + k] = np.stack(list(fresh.values()))
+        self.vecs.flush()
+        # vectors first, then hashes: a crash in between only loses the new rows
+        with open(self.idx_path, "ab") as f:
+            f.write("".join(h + "\n" for h in fresh).encode("ascii"))
+            self._idx_off = f.tell()
+        for j, h in enumerate(fresh):
+            self.rows[h] = start + j
+        self.n += k
+        self.mtime = self._idx_mtime()
+
+_embed_caches: Dict[str, EmbedCache] = {}
+_embed_caches_lock = threading.Lock()
+
+def load_embed_cache(cache_fp: str, dim: int) -> EmbedCache:
+    # opened once per process and kept (one stat per call); hits are row reads from
+    # the mapped file. Rows appended by another process are folded in from the sidecar's
+    # tail; a full reopen only happens if it was reset or the dim changed.
+    with _embed_caches_lock:
+        cache = _embed_caches.get(cache_fp)
+        if cache is None or cache.dim != dim or (cache.is_stale() and not cache.refresh()):
+            legacy = Config.EMBED_CACHE_PATH if cache_fp == Config.EMBED_CACHE_VEC_PATH else None
+            cache = EmbedCache(cache_fp, dim, legacy_jsonl=legacy)
+            _embed_caches[cache_fp] = cache
+        return cache
+
+# --- Hybrid query knobs (read once at import) ---
+try:
+    # Prefer Config.CHAT_CONF_THRESHOLD, else env, else 0.35
+    _CHAT_CONF_THRESHOLD = float(getattr(Config, "CHAT_CONF_THRESHOLD", os.getenv("CHAT_CONF_THRESHOLD", 0.35)))
+except Exception:
+    _CHAT_CONF_THRESHOLD = 0.35
+
+try:
+    _SNIP_CTX_BUDGET = int(getattr(Config, "SNIP_CTX_BUDGET_CHARS", os.getenv("SNIP_CTX_BUDGET_CHARS", 2000)))
+except Exception:
+    _SNIP_CTX_BUDGET = 2000
 
-def _snip_ctx_budget_chars() -> int:
-    try:
-        return int(getattr(Config, "SNIP_CTX_BUDGET_CHARS", os.getenv("SNIP_CTX_BUDGET_CHARS", 2000)))
-    except Exception:
-        return 2000
-    
 def _topsnips_sidecar_path(pdf_path: str) -> str:
     base = os.path.basename(pdf_path)
     return os.path.join(Config.UPLOAD_DIR, f"{base}.topsnips.json")
 
+def _topsnips_vec_path(pdf_path: str) -> str:
+    # normalized snippet embeddings, one row per sidecar snippet
+    return os.path.splitext(_topsnips_sidecar_path(pdf_path))[0] + ".npy"
+
 def _load_sidecar(pdf_path: str) -> Optional[Dict[str, Any]]:
     sc = _topsnips_sidecar_path(pdf_path)
     if not os.path.exists(sc):
         return None
     try:
-        with open(sc, "r", encoding="utf-8") as f:
-            return json.load(f)
+        data = _read_json(sc)
     except Exception as e:
         print(f"[WARN] failed to load sidecar {sc}: {e}")
         return None
+    try:
+        vecs = np.load(_topsnips_vec_path(pdf_path))
+        if vecs.shape == (len(data.get("snippets") or []), Config.EMBED_DIM):
+            data["_vecs"] = vecs
+    except Exception:
+        pass  # older sidecar or other model: snippets get embedded at query time
+    return data
 
 # ---- embedding & gen
 _embed_limiter = RpsLimiter(Config.EMBED_RPS)
 _gen_limiter = RpsLimiter(Config.GEN_RPS)
 
+@lru_cache(maxsize=None)
+def _embed_cfg(task_type: str, dim: int):
+    return _genai_types.EmbedContentConfig(task_type=task_type, output_dimensionality=dim)
+
+@lru_cache(maxsize=None)
+def _gen_cfg(temperature: float, max_output_tokens: int, top_p: Optional[float] = None):
+    return _genai_types.GenerateContentConfig(
+        temperature=temperature, top_p=top_p, max_output_tokens=max_output_tokens
+    )
+
 def embed_texts(texts: List[str], model: str, dim: int, task_type: str, cache_fp: Optional[str]) -> np.ndarray:
     if not texts:
         return np.zeros((0, dim), dtype=np.float32)
     client = ensure_genai_client()
-    cache = load_embed_cache(cache_fp) if cache_fp else {}
+    cache = load_embed_cache(cache_fp, dim) if cache_fp else None
     outM = np.zeros((len(texts), dim), dtype=np.float32)
-    todo_idxs, todo_texts, new_cache = [], [], []
-
-    for i, t in enumerate(texts):
-        h = _hash_text(t)
-        if h in cache:
-            v = np.array(cache[h], dtype=np.float32)
-            if v.shape[0] == dim:
-                outM[i] = v
-                continue
-        todo_idxs.append(i)
-        todo_texts.append(t)
-
-    for start in range(0, len(todo_texts), Config.EMBED_BATCH):
-        end = min(start + Config.EMBED_BATCH, len(todo_texts))
-        batch = todo_texts[start:end]
-
+    if cache is not None:
+        # hashed once here and reused when the misses are written back
+        hashes = [_hash_text(t) for t in texts]
+        todo_idxs = cache.lookup(hashes, outM)
+    else:
+        todo_idxs = list(range(len(texts)))
+    # identical texts (repeated headers/footers, re-sent snippets) are embedded once
+    first: Dict[str, int] = {}
+    dups = []
+    for i in todo_idxs:
+        j = first.setdefault(texts[i], i)
+        if j != i:
+            dups.append((i, j))
+    if dups:
+        todo_idxs = list(first.values())
+    todo_texts = [texts[i] for i in todo_idxs]
+    new_cache = []
+
+    batches = [(start, todo_texts[start:start + Config.EMBED_BATCH])
+               for start in range(0, len(todo_texts), Config.EMBED_BATCH)]
+
+    cfg = _embed_cfg(task_type, dim)
+
+    def _embed_batch(batch):
         def _call():
-            from google.genai import types
-            return client.models.embed_content(
-                model=model,
-                contents=batch,
-                config=types.EmbedContentConfig(task_type=task_type, output_dimensionality=dim),
-            )
-
-        res = with_retry(_call, _embed_limiter, Config.MAX_RETRIES, Config.BASE_BACKOFF, Config.MAX_BACKOFF)
+            return client.models.embed_content(model=model, contents=batch, config=cfg)
+        # _embed_limiter still spaces request starts across all workers
+        return with_retry(_call, _embed_limiter, Config.MAX_RETRIES, Config.BASE_BACKOFF, Config.MAX_BACKOFF)
+
+    def _store(start, res):
+        # each batch owns a disjoint slice of todo_idxs, so workers never write the same row
         for j, e in enumerate(res.embeddings):
             idx = todo_idxs[start + j]
-            vec = np.array(e.values, dtype=np.float32)
-            outM[idx] = vec
+            outM[idx] = e.values  # coerced straight into the row, no temporary array
             if cache is not None:
-                new_cache.append((_hash_text(texts[idx]), vec.astype(float).tolist()))
-    if cache_fp and new_cache:
-        append_embed_cache(cache_fp, new_cache)
+                new_cache.append((hashes[idx], outM[idx]))  # row view; copied into the cache file below
+
+    workers = min(Config.EMBED_CONCURRENCY, len(batches))
+    if workers <= 1:
+        for start, batch in batches:
+            _store(start, _embed_batch(batch))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futs = {ex.submit(_embed_batch, batch): start for start, batch in batches}
+            try:
+                for fut in as_completed(futs):
+                    _store(futs[fut], fut.result())
+            except Exception:
+                for fut in futs:
+                    fut.cancel()
+                raise
+    for i, j in dups:
+        outM[i] = outM[j]
+    if cache is not None and new_cache:
+        cache.append(new_cache)
     return outM
 
+class EmbedBatcher:
+    """Coalesces single-text embed requests that arrive close together into one API call.
+
+    ``finish(M, args)`` may turn the embedded batch into per-request results (one per
+    row); by default each future gets its embedding row.
+    """
+
+    def __init__(self, task_type: str, window_ms: float, max_batch: int,
+                 finish: Optional[Callable[[np.ndarray, List[Any]], List[Any]]] = None):
+        self.task_type = task_type
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.finish = finish
+        self._pending: List[Tuple[str, Any, Future]] = []
+        self._cv = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, text: str, arg: Any = None) -> Future:
+        fut: Future = Future()
+        if self.window <= 0:
+            try:
+                fut.set_result(self._handle([text], [arg])[0])
+            except Exception as e:
+                fut.set_exception(e)
+            return fut
+        with self._cv:
+            self._pending.append((text, arg, fut))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+        return fut
+
+    def _handle(self, texts: List[str], args: List[Any]) -> List[Any]:
+        M = embed_texts(texts, Config.EMBED_MODEL, Config.EMBED_DIM, self.task_type, cache_fp=None)
+        return self.finish(M, args) if self.finish else list(M)
+
+    def _next_batch(self) -> List[Tuple[str, Any, Future]]:
+        with self._cv:
+            while not self._pending:
+                self._cv.wait()
+            # the first request opens the window; a full batch closes it early
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_batch:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self._cv.wait(left)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self._handle([t for t, _, _ in batch], [a for _, a, _ in batch])
+            except Exception as e:
+                for _, _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, _, fut), res in zip(batch, results):
+                fut.set_result(res)
+
+# query embeddings for snippet selection; topk_search has its own batcher that also scores
+_query_batcher = EmbedBatcher("QUESTION_ANSWERING", Config.EMBED_BATCH_WINDOW_MS, Config.EMBED_BATCH)
+
+_ANSWER_HEAD = (
+    "You are a helpful document analyst. Based ONLY on the provided PDF excerpts below, "
+    "answer the user's question with specific insights and details.\n\n"
+    "IMPORTANT RULES:\n"
+    "- Use ONLY information from the provided excerpts\n"
+    "- Always provide a substantive answer if any relevant information exists\n"
+    "- If the excerpts contain relevant information, explain what they reveal\n"
+    "- Reference specific details, examples, or concepts from the excerpts\n"
+    "- If truly no relevant information exists, clearly state that\n"
+    "- NEVER give an empty response\n"
+    "- Write in a clear, informative style\n\n"
+)
+
 def make_prompt(query: str, contexts: List[Dict[str, Any]]) -> str:
-    used = 0
-    parts = []
-    for c in contexts:
-        t = c['text'][:Config.CTX_SNIPPET_CHARS]
-        if used + len(t) > Config.CTX_BUDGET_CHARS:
-            break
-        used += len(t)
-        parts.append(f"[{c['rank']}] {c['pdf_name']} p.{c['page']} ({c['start']}-{c['end']}):\n{t}")
-    ctx = "\n\n".join(parts)
-    
-    head = (
-        "You are a helpful document analyst. Based ONLY on the provided PDF excerpts below, "
-        "answer the user's question with specific insights and details.\n\n"
-        "IMPORTANT RULES:\n"
-        "- Use ONLY information from the provided excerpts\n"
-        "- Always provide a substantive answer if any relevant information exists\n"
-        "- If the excerpts contain relevant information, explain what they reveal\n"
-        "- Reference specific details, examples, or concepts from the excerpts\n"
-        "- If truly no relevant information exists, clearly state that\n"
-        "- NEVER give an empty response\n"
-        "- Write in a clear, informative style\n\n"
+    snippets = [c['text'][:Config.CTX_SNIPPET_CHARS] for c in contexts]
+    # prefix sums of snippet lengths; the budget cut is one bisect instead of a running check
+    cut = bisect.bisect_right(list(accumulate(map(len, snippets))), Config.CTX_BUDGET_CHARS)
+    ctx = "\n\n".join(
+        f"[{c['rank']}] {c['pdf_name']} p.{c['page']} ({c['start']}-{c['end']}):\n{t}"
+        for c, t in zip(contexts[:cut], snippets[:cut])
     )
-    
-    return f"{head}QUESTION: {query}\n\nPDF EXCERPTS:\n{ctx}\n\nDETAILED ANSWER:"
+    return f"{_ANSWER_HEAD}QUESTION: {query}\n\nPDF EXCERPTS:\n{ctx}\n\nDETAILED ANSWER:"
+
+# finish reasons where re-asking the same prompt gets the same refusal
+_NO_RETRY_FINISH = {"SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII"}
+
+def _blocked_reason(resp) -> Optional[str]:
+    fb = getattr(resp, "prompt_feedback", None)
+    if fb is not None and getattr(fb, "block_reason", None):
+        return f"prompt blocked ({getattr(fb.block_reason, 'name', fb.block_reason)})"
+    try:
+        fr = resp.candidates[0].finish_reason
+    except Exception:
+        return None
+    name = getattr(fr, "name", None) or str(fr or "")
+    return f"finish reason {name}" if name in _NO_RETRY_FINISH else None
 
 def generate_answer(query: str, contexts: List[Dict[str, Any]], model: str, temperature: float) -> str:
     client = ensure_genai_client()
-    
-    def _call():
-        from google.genai import types
-        prompt = make_prompt(query, contexts)
-        return client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=temperature, 
-                max_output_tokens=Config.MAX_OUTPUT_TOKENS_DEFAULT
-            ),
-        )
+    generate = client.models.generate_content
+    prompt = make_prompt(query, contexts)
 
     # Try generating answer up to 3 times if empty
     for attempt in range(3):
+        cfg = _gen_cfg(temperature, Config.MAX_OUTPUT_TOKENS_DEFAULT)
         try:
-            resp = with_retry(_call, _gen_limiter, Config.MAX_RETRIES, Config.BASE_BACKOFF, Config.MAX_BACKOFF)
+            resp = with_retry(lambda: generate(model=model, contents=prompt, config=cfg),
+                              _gen_limiter, Config.MAX_RETRIES, Config.BASE_BACKOFF, Config.MAX_BACKOFF)
             answer = (getattr(resp, "text", None) or "").strip()
             
             if answer:  # Got a non-empty answer
                 return answer
+            blocked = _blocked_reason(resp)
+            if blocked:  # a retry would be refused the same way
+                print(f"Empty answer ({blocked}), using fallback")
+                return generate_fallback_answer(query, contexts)
             elif attempt < 2:  # Retry with different temperature
                 temperature = min(0.9, temperature + 0.2)
                 print(f"Empty answer attempt {attempt + 1}, retrying with temperature {temperature}")
@@ -233,6 +715,62 @@ def generate_answer(query: str, contexts: List[Dict[str, Any]], model: str, temp
                 print(f"Answer generation failed after 3 attempts: {e}")
                 return generate_fallback_answer(query, contexts)
             
+def _slm_candidates(rows: List[Dict[str, Any]]) -> Tuple[List[int], str]:
+    """Top ~200 rows by length (indices into `rows`) and their 1-based numbered list."""
+    # Pre-filter candidates: favor longer, denser snippets to keep prompt small
+    by_len = sorted(range(len(rows)), key=lambda i: len(rows[i].get("text") or ""), reverse=True)
+    # boilerplate that repeats across pages would otherwise take several candidate slots
+    seen, order = set(), []
+    for i in by_len:
+        t = rows[i].get("text") or ""
+        if t not in seen:
+            seen.add(t)
+            order.append(i)
+            if len(order) == 200:
+                break
+    lines = []
+    for n, i in enumerate(order, start=1):
+        # keep snippets compact
+        t = (rows[i].get("text") or "").strip().replace("\n", " ")
+        lines.append(f"{n}. {t[:500]}…" if len(t) > 500 else f"{n}. {t}")
+    return order, "\n".join(lines)
+
+def _picks_from_choices(order: List[int], choices: Any, k: int) -> List[int]:
+    # map 1-based choices back to row indices; de-dup, cap to k, fall back to the longest
+    out: List[int] = []
+    for one_based in (choices if isinstance(choices, list) else []):
+        try:
+            ci = int(one_based) - 1
+        except Exception:
+            continue
+        if 0 <= ci < len(order) and order[ci] not in out:
+            out.append(order[ci])
+            if len(out) >= k:
+                break
+    return out or order[:k]
+
+def _slm_json(prompt: str, max_tokens: int) -> Dict[str, Any]:
+    model = _get_slm_model()
+    if not model:
+        return {}
+    try:
+        client = ensure_genai_client()
+        resp = client.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=_gen_cfg(0.2, max_tokens, 0.8),
+        )
+        text = getattr(resp, "text", "") or ""
+        # outermost braces by a forward and a backward scan (same span the greedy regex took)
+        start, end = text.find("{"), text.rfind("}")
+        if not 0 <= start < end:
+            return {}
+        payload = text[start:end + 1]
+        data = orjson.loads(payload) if _HAS_ORJSON else json.loads(payload)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
 def _rank_snippets_with_slm(rows: List[Dict[str, Any]], k: int) -> List[int]:
     """
     Use a small LLM (SLM) to choose the top-K most informative/self-contained snippets
@@ -240,87 +778,59 @@ def _rank_snippets_with_slm(rows: List[Dict[str, Any]], k: int) -> List[int]:
     """
     if not rows:
         return []
-
-    # Pre-filter candidates: favor longer, denser snippets to keep prompt small
-    # You can tune these numbers freely.
-    candidates = sorted(
-        [(i, r) for i, r in enumerate(rows)],
-        key=lambda x: len((x[1].get("text") or "")),
-        reverse=True
-    )
-
-    # cap to ~200 candidates to keep prompt manageable
-    candidates = candidates[:200]
-
-    # Build the numbered list
-    numbered = []
-    for idx, (_, r) in enumerate(candidates, start=1):
-        t = (r.get("text") or "").strip()
-        t = t.replace("\n", " ")
-        # keep snippets compact
-        if len(t) > 500:
-            t = t[:500] + "…"
-        numbered.append(f"{idx}. {t}")
-
+    order, numbered = _slm_candidates(rows)
     prompt = (
         "You are ranking excerpts from a single PDF. "
         "Pick the K most informative, self-contained, representative snippets that give high-level coverage. "
         "Return STRICT JSON: {\"choices\": [idx1, idx2, ...]} using the indices shown.\n\n"
         f"K = {k}\n\n"
-        "SNIPPETS:\n" + "\n".join(numbered)
+        "SNIPPETS:\n" + numbered
     )
+    return _picks_from_choices(order, _slm_json(prompt, 400).get("choices"), k)
 
-    model = _get_slm_model()
-    if not model:
-        # Fallback: just take the first K candidates
-        return [candidates[i][0] for i in range(min(k, len(candidates)))]
-
-    try:
-        client = ensure_genai_client()
-        from google.genai import types
-        resp = client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.2, top_p=0.8, max_output_tokens=400
-            ),
+def _rank_snippets_batch(rows_per_pdf: List[List[Dict[str, Any]]], k: int) -> List[List[int]]:
+    """
+    Like _rank_snippets_with_slm for several PDFs, packing as many PDFs per SLM call as
+    fit in Config.SLM_RANK_BATCH_CHARS of candidate text.
+    """
+    cands = [_slm_candidates(rows) if rows else ([], "") for rows in rows_per_pdf]
+    out: List[List[int]] = [[] for _ in rows_per_pdf]
+    groups: List[List[int]] = []
+    size = 0
+    for i, (order, numbered) in enumerate(cands):
+        if not order:
+            continue
+        if not groups or size + len(numbered) > Config.SLM_RANK_BATCH_CHARS:
+            groups.append([])
+            size = 0
+        groups[-1].append(i)
+        size += len(numbered)
+    for g in groups:
+        if len(g) == 1:
+            out[g[0]] = _rank_snippets_with_slm(rows_per_pdf[g[0]], k)
+            continue
+        sections = "\n\n".join(f"PDF {n}:\n{cands[i][1]}" for n, i in enumerate(g, start=1))
+        prompt = (
+            f"You are ranking excerpts from {len(g)} separate PDFs. For EACH PDF, "
+            "pick the K most informative, self-contained, representative snippets that give high-level coverage of that PDF. "
+            "Return STRICT JSON mapping each PDF number to the indices shown in its section: "
+            "{\"1\": [idx1, idx2, ...], \"2\": [...], ...}\n\n"
+            f"K = {k}\n\n" + sections
         )
-        text = (getattr(resp, "text", "") or "").strip()
-        import json, re
-        m = re.search(r"\{.*\}", text, re.S)
-        data = json.loads(m.group(0)) if m else {}
-        idxs = data.get("choices", [])
-        # map back from 1-based `idxs` into original rows indices
-        chosen = []
-        for one_based in idxs:
-            try:
-                ci = int(one_based) - 1
-                if 0 <= ci < len(candidates):
-                    chosen.append(candidates[ci][0])  # original rows index
-            except Exception:
-                continue
-        if not chosen:
-            # fallback if the model didn't return usable JSON
-            chosen = [candidates[i][0] for i in range(min(k, len(candidates)))]
-        # de-dup and cap to k
-        out = []
-        for x in chosen:
-            if x not in out:
-                out.append(x)
-            if len(out) >= k:
-                break
-        return out
-    except Exception:
-        # conservative fallback
-        return [candidates[i][0] for i in range(min(k, len(candidates)))]
-    
+        data = _slm_json(prompt, 400 * len(g))
+        for n, i in enumerate(g, start=1):
+            out[i] = _picks_from_choices(cands[i][0], data.get(str(n)), k)
+    return out
+
 def _build_and_save_top_snippets_for_pdf(pdf_path: str, k: int) -> Optional[str]:
     """Create sidecar JSON with the top-K snippets for a given PDF."""
+    rows = extract_pdf_chunks(pdf_path)  # uses Config.CHUNK_CHARS, etc.
+    if not rows:
+        return None
+    return _save_top_snippets(pdf_path, rows, _rank_snippets_with_slm(rows, k), k)
+
+def _save_top_snippets(pdf_path: str, rows: List[Dict[str, Any]], picks: List[int], k: int) -> Optional[str]:
     try:
-        rows = extract_pdf_chunks(pdf_path)  # uses Config.CHUNK_CHARS, etc.
-        if not rows:
-            return None
-        picks = _rank_snippets_with_slm(rows, k)
         # build manifest in rank order
         chosen = []
         for rank, idx in enumerate(picks, start=1):
@@ -343,8 +853,18 @@ def _build_and_save_top_snippets_for_pdf(pdf_path: str, k: int) -> Optional[str]
         }
         sidecar = _topsnips_sidecar_path(pdf_path)
         os.makedirs(os.path.dirname(sidecar), exist_ok=True)
-        with open(sidecar, "w", encoding="utf-8") as f:
-            json.dump(out, f, ensure_ascii=False, indent=2)
+        _write_json(sidecar, out)
+        try:
+            # same texts and task type as the index chunks, so these are embed-cache hits
+            V = embed_texts([c["text"] for c in chosen], Config.EMBED_MODEL, Config.EMBED_DIM,
+                            "RETRIEVAL_DOCUMENT", cache_fp=Config.EMBED_CACHE_VEC_PATH)
+            np.save(_topsnips_vec_path(pdf_path), l2norm_rows(V))
+        except Exception as e:
+            print(f"[WARN] snippet vectors failed for {pdf_path}: {e}")
+            try:
+                os.remove(_topsnips_vec_path(pdf_path))  # never pair new snippets with old rows
+            except OSError:
+                pass
         return sidecar
     except Exception as e:
         print(f"[WARN] top-snippets failed for {pdf_path}: {e}")
@@ -356,12 +876,12 @@ def generate_fallback_answer(query: str, contexts: List[Dict[str, Any]]) -> str:
         return f"I couldn't find relevant information about '{query}' in the uploaded documents."
     
     # Create a structured response from the contexts
-    key_points = []
-    for i, ctx in enumerate(contexts[:3]):  # Use top 3 contexts
-        snippet = ctx['text'][:200].strip()
-        if snippet:
-            key_points.append(f"• From {ctx.get('pdf_name', 'document')} (page {ctx.get('page', '?')}): {snippet}...")
-    
+    key_points = [
+        f"• From {ctx.get('pdf_name', 'document')} (page {ctx.get('page', '?')}): {snippet}..."
+        for ctx in contexts[:3]  # Use top 3 contexts
+        if (snippet := ctx['text'][:200].strip())
+    ]
+
     if key_points:
         return f"Based on your query about '{query}', here are the most relevant findings:\n\n" + "\n".join(key_points)
     else:
@@ -378,16 +898,20 @@ def _choose_relevant_snippets_for_query(
     Flatten sidecar snippets, score each against the question via embeddings, and
     pick the best within a character budget.
     """
-    total_budget_chars = int(total_budget_chars or _snip_ctx_budget_chars())
+    total_budget_chars = int(total_budget_chars or _SNIP_CTX_BUDGET)
 
-    # Flatten with a record of its source pdf
-    flat = []
+    # Flatten with a record of its source pdf, plus the stored embedding when there is one
+    # (or the unstripped text it would be embedded from, matching the index cache keys)
+    flat, flat_vecs, seen = [], [], set()
     for sc in (sidecars or []):
         pdf_path = sc.get("pdf_path")
-        for sn in (sc.get("snippets") or []):
+        sc_vecs = sc.get("_vecs")
+        for j, sn in enumerate(sc.get("snippets") or []):
             t = (sn.get("text") or "").strip()
-            if not t:
-                continue
+            if not t or t in seen:
+                continue  # the same boilerplate picked from several PDFs is scored once
+            seen.add(t)
+            flat_vecs.append(sn["text"] if sc_vecs is None else sc_vecs[j])
             flat.append({
                 "pdf_path": pdf_path,
                 "pdf_name": sn.get("pdf_name"),
@@ -403,19 +927,26 @@ def _choose_relevant_snippets_for_query(
     # Optional: cap per-pdf before scoring
     if max_per_pdf and max_per_pdf > 0:
         by_pdf = {}
-        for sn in flat:
-            by_pdf.setdefault(sn["pdf_path"], []).append(sn)
-        flat = [s for pdf, arr in by_pdf.items() for s in arr[:max_per_pdf]]
+        for i, sn in enumerate(flat):
+            by_pdf.setdefault(sn["pdf_path"], []).append(i)
+        keep = [i for arr in by_pdf.values() for i in arr[:max_per_pdf]]
+        flat = [flat[i] for i in keep]
+        flat_vecs = [flat_vecs[i] for i in keep]
 
     # Score by cosine similarity using the same embed model
-    texts = [s["text"] for s in flat]
-    Q = embed_texts([q], Config.EMBED_MODEL, Config.EMBED_DIM, "QUESTION_ANSWERING", cache_fp=None)
-    if Q.shape[0] == 0:
-        return []
-    qv = Q[0]
-    qv = qv / (np.linalg.norm(qv) + 1e-12)
-    M = embed_texts(texts, Config.EMBED_MODEL, Config.EMBED_DIM, "RETRIEVAL_QUERY", cache_fp=None)
-    M = l2norm_rows(M)
+    qv = l2norm_vec(_query_batcher.submit(q).result())
+    M = np.empty((len(flat), Config.EMBED_DIM), dtype=np.float32)
+    cold = []
+    for i, v in enumerate(flat_vecs):
+        if isinstance(v, str):
+            cold.append(i)
+        else:
+            M[i] = v
+    if cold:
+        # sidecars from before vectors were stored; chunk texts usually hit the index cache
+        M[cold] = l2norm_rows(embed_texts([flat_vecs[i] for i in cold], Config.EMBED_MODEL,
+                                          Config.EMBED_DIM, "RETRIEVAL_DOCUMENT",
+                                          cache_fp=Config.EMBED_CACHE_VEC_PATH))
     sims = (M @ qv)
 
     # Sort by score desc
@@ -434,44 +965,37 @@ def _choose_relevant_snippets_for_query(
             break
     return picked
 
+_SNIP_HEAD = (
+    "You are a careful analyst. Based ONLY on the curated snippets below, "
+    "answer the user's question. Important:\n"
+    "- Use only information present in the snippets\n"
+    "- If snippets disagree, note the disagreement and give a cautious answer\n"
+    "- Reference snippets by [S#] tags where helpful (no file names)\n"
+    "- Provide a clear, substantive answer\n\n"
+)
+
 def _make_snip_prompt(query: str, snips: List[Dict[str, Any]]) -> str:
     used = 0
     parts = []
-    budget = _snip_ctx_budget_chars()
+    add = parts.append
+    budget = _SNIP_CTX_BUDGET
     for i, s in enumerate(snips, start=1):
         t = (s.get("text") or "").strip()
         if not t:
             continue
-        tag = f"[S{i}]"
-        chunk = f"{tag} {t}\n\n"
-        if used + len(chunk) > budget:
-            break
-        parts.append(chunk)
+        chunk = f"[S{i}] {t}\n\n"
         used += len(chunk)
-
-    head = (
-        "You are a careful analyst. Based ONLY on the curated snippets below, "
-        "answer the user's question. Important:\n"
-        "- Use only information present in the snippets\n"
-        "- If snippets disagree, note the disagreement and give a cautious answer\n"
-        "- Reference snippets by [S#] tags where helpful (no file names)\n"
-        "- Provide a clear, substantive answer\n\n"
-    )
-    return f"{head}QUESTION: {query}\n\nSNIPPETS:\n{''.join(parts)}\nANSWER:"
+        if used > budget:
+            break
+        add(chunk)
+    return f"{_SNIP_HEAD}QUESTION: {query}\n\nSNIPPETS:\n{''.join(parts)}\nANSWER:"
 
 def _generate_answer_from_snippets(query: str, snips: List[Dict[str, Any]], model: str, temperature: float) -> str:
     client = ensure_genai_client()
-    from google.genai import types
     prompt = _make_snip_prompt(query, snips)
+    cfg = _gen_cfg(temperature, Config.MAX_OUTPUT_TOKENS_DEFAULT)
     def _call():
-        return client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=temperature,
-                max_output_tokens=Config.MAX_OUTPUT_TOKENS_DEFAULT,
-            ),
-        )
+        return client.models.generate_content(model=model, contents=prompt, config=cfg)
     resp = with_retry(_call, _gen_limiter, Config.MAX_RETRIES, Config.BASE_BACKOFF, Config.MAX_BACKOFF)
     return (getattr(resp, "text", "") or "").strip()
 
@@ -479,8 +1003,33 @@ def _generate_answer_from_snippets(query: str, snips: List[Dict[str, Any]], mode
 class RAGIndex:
     def __init__(self):
         self.lock = threading.Lock()
-        self.V: Optional[np.ndarray] = None
+        self.V: Optional[np.ndarray] = None  # view of the first _V_len rows of the mapped _V_buf
+        self._V_buf: Optional[np.ndarray] = None
+        self._V_len = 0
+        self._tls = threading.local()  # per-thread similarity buffers for topk_search
+        # optional int8 copy of V (rebuilt from the float32 file, never persisted)
+        self._int8 = Config.RAG_INT8_SEARCH and _HAS_NUMBA
+        self._Vq_buf: Optional[np.ndarray] = None
+        self._Vs_buf: Optional[np.ndarray] = None
+        self._Vq_len = 0
+        # optional HNSW graph over the first _ann_state[1] rows; rows appended later are
+        # scored exactly until a background rebuild swaps in a new graph
+        self._ann_state: Tuple[Any, int] = (None, 0)
+        self._ann_lock = threading.Lock()
+        self._ann_building = False
+        self._vec_gen = 0  # bumped whenever rows are renumbered (full rewrite)
         self.metas: List[Dict[str, Any]] = []
+        # removed files are tombstoned in _alive rather than rewritten; file_ranges maps each
+        # abs pdf path to its [start, end) row runs so a removal only touches its own rows
+        self._alive = np.ones(0, dtype=bool)
+        self._n_dead = 0
+        self.file_ranges: Dict[str, List[Tuple[int, int]]] = {}
+        # (V, metas, n, Vq, Vs, dead) for readers, replaced whole by _publish() so topk_search
+        # never waits on the lock or sees V and metas from different writes
+        self._snapshot: Tuple[Any, ...] = (None, [], 0, None, None, _NO_ROWS)
+        # concurrent queries share one embed call and are scored together against V
+        self._search_batcher = EmbedBatcher("QUESTION_ANSWERING", Config.EMBED_BATCH_WINDOW_MS,
+                                            Config.EMBED_BATCH, finish=self._score_queries)
         self.files_reg: Dict[str, Dict[str, Any]] = {}
         self.is_indexing = False
         self.last_updated = None
@@ -488,67 +1037,136 @@ class RAGIndex:
 
     def build_top_snippets(self, pdf_paths: List[str], k: Optional[int] = None):
         """Synchronous: build and save top-K snippet sidecars for each path."""
-        k = int(k or _get_top_k())
-        for p in (pdf_paths or []):
-            if os.path.isfile(p):
-                _build_and_save_top_snippets_for_pdf(p, k)
+        k = int(k or _TOP_K)
+        paths = [p for p in (pdf_paths or []) if os.path.isfile(p)]
+        rows_per_pdf = [extract_pdf_chunks(p) for p in paths]
+        # small PDFs share one SLM call
+        for p, rows, picks in zip(paths, rows_per_pdf, _rank_snippets_batch(rows_per_pdf, k)):
+            if rows:
+                _save_top_snippets(p, rows, picks, k)
 
     def remove_sidecars(self, pdf_paths: List[str]):
         """Remove top-snippet sidecar files for given pdfs."""
         for p in (pdf_paths or []):
-            sc = _topsnips_sidecar_path(p)
-            try:
-                if os.path.exists(sc):
-                    os.remove(sc)
-            except Exception:
-                pass
+            for sc in (_topsnips_sidecar_path(p), _topsnips_vec_path(p)):
+                try:
+                    if os.path.exists(sc):
+                        os.remove(sc)
+                except Exception:
+                    pass
+
+    @property
+    def live_rows(self) -> int:
+        """Indexed rows not tombstoned by a removal (those stay in metas until compaction)."""
+        return len(self.metas) - self._n_dead
+
+    def _publish(self):
+        # metas only ever grow in place or get replaced, so rows [0, n) of the list we hand
+        # out stay valid; vector buffers are likewise swapped rather than rewritten below n
+        n = min(self._V_len, len(self.metas))
+        Vq = Vs = None
+        if self._int8 and self._Vq_buf is not None and self._Vq_len >= n:
+            Vq, Vs = self._Vq_buf[:n], self._Vs_buf[:n]
+        dead = np.flatnonzero(~self._alive[:n]) if self._n_dead else _NO_ROWS
+        self._snapshot = (self.V, self.metas, n, Vq, Vs, dead)
 
     def _rewrite_meta_file(self):
         # Rewrites the meta file from self.metas (full snapshot).
-        with open(Config.META_PATH, "w", encoding="utf-8") as f:
-            for r in self.metas:
-                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        with open(Config.META_PATH, "wb") as f:
+            f.write(b"".join(_json_line(r) for r in self.metas))
+
+    def _index_ranges(self, start: int):
+        """Record the row runs of metas[start:] in file_ranges."""
+        metas, n, i = self.metas, len(self.metas), start
+        while i < n:
+            p = metas[i].get("pdf_path", "")
+            j = i + 1
+            while j < n and metas[j].get("pdf_path", "") == p:
+                j += 1
+            runs = self.file_ranges.setdefault(os.path.abspath(p), [])
+            if runs and runs[-1][1] == i:
+                runs[-1] = (runs[-1][0], j)
+            else:
+                runs.append((i, j))
+            i = j
+
+    def _grow_alive(self, n: int):
+        if self._alive.shape[0] < n:
+            alive = np.ones(max(n, 2 * self._alive.shape[0]), dtype=bool)
+            alive[:self._alive.shape[0]] = self._alive
+            self._alive = alive
+
+    def _load_alive(self):
+        self._alive, self._n_dead = np.ones(len(self.metas), dtype=bool), 0
+        try:
+            with open(Config.ALIVE_PATH, "rb") as f:
+                raw = f.read()
+            rows = int(np.frombuffer(raw[:8], dtype="<i8")[0])
+        except (OSError, IndexError):
+            return
+        if rows > len(self.metas):
+            return  # written before a compaction that was interrupted; rows were renumbered
+        self._alive[:rows] = np.unpackbits(np.frombuffer(raw, dtype=np.uint8, offset=8), count=rows)
+        self._n_dead = rows - int(np.count_nonzero(self._alive[:rows]))
+
+    def _save_alive(self):
+        # a row-count header lets _load_alive spot a bitmap that predates a compaction
+        n = len(self.metas)
+        tmp = Config.ALIVE_PATH + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(np.int64(n).astype("<i8").tobytes())
+            f.write(np.packbits(self._alive[:n]).tobytes())
+        os.replace(tmp, Config.ALIVE_PATH)
+
+    def _compact_locked(self):
+        """Drop tombstoned rows from vectors and metas (full rewrite)."""
+        n = min(self._V_len, len(self.metas))  # also drops metas without vectors
+        keep = np.flatnonzero(self._alive[:n])
+        self.metas = [self.metas[i] for i in keep]
+        self._set_vectors(self.V[keep] if self.V is not None else
+                          np.zeros((0, Config.EMBED_DIM), dtype=np.float32))
+        self._rewrite_meta_file()
+        self._alive, self._n_dead = np.ones(len(self.metas), dtype=bool), 0
+        try:
+            os.remove(Config.ALIVE_PATH)
+        except OSError:
+            pass
+        self.file_ranges = {}
+        self._index_ranges(0)
+
+    def _tombstone_locked(self, abs_paths) -> bool:
+        """Assumes self.lock is already held. Marks every row of the given abs paths dead;
+        False if none of them had rows."""
+        runs = [r for ap in abs_paths for r in self.file_ranges.pop(ap, ())]
+        if not runs:
+            return False
+        # alive and graph marks change together, so a concurrent ANN build sees both or neither
+        with self._ann_lock:
+            ann, ann_rows = self._ann_state
+            for s, e in runs:
+                self._n_dead += int(np.count_nonzero(self._alive[s:e]))
+                self._alive[s:e] = False
+                if ann is not None and s < ann_rows:
+                    _mark_dead(ann, range(s, min(e, ann_rows)))
+        if len(self.metas) - self._n_dead < Config.RAG_COMPACT_BELOW * len(self.metas):
+            self._compact_locked()
+        else:
+            self._save_alive()
+        return True
 
     def _remove_paths_from_index_locked(self, abs_paths: List[str]):
-        """Assumes self.lock is already held. Removes all rows/vectors for given pdf paths."""
+        """Assumes self.lock is already held. Tombstones all rows for given pdf paths."""
         if not abs_paths:
             return
 
-        # Build a keep-mask so we can filter both metas and V consistently.
         path_set = set(map(os.path.abspath, abs_paths))
-        keep_idxs = []
-        for i, m in enumerate(self.metas):
-            p = os.path.abspath(m.get("pdf_path", ""))
-            if p not in path_set:
-                keep_idxs.append(i)
-
-        # Nothing to drop
-        if len(keep_idxs) == len(self.metas):
+        had_rows = self._tombstone_locked(path_set)
+        dropped = [ap for ap in path_set if self.files_reg.pop(ap, None) is not None]
+        if not had_rows and not dropped:
             return
 
-        # Filter metas
-        self.metas = [self.metas[i] for i in keep_idxs]
-
-        # Filter vectors (guard for partial writes)
-        if self.V is not None and self.V.size > 0:
-            n_vecs = int(self.V.shape[0])
-            n_meta = len(keep_idxs)
-            # keep only valid range then index
-            if n_vecs >= len(keep_idxs):
-                self.V = self.V[keep_idxs, :]
-            else:
-                # If vectors < metas (shouldn't happen but be safe), truncate metas to match.
-                self.metas = self.metas[:n_vecs]
-
-        # Update registry: drop removed files
-        for ap in path_set:
-            if ap in self.files_reg:
-                self.files_reg.pop(ap, None)
-
-        # Persist snapshot
-        self._rewrite_meta_file()
-        np.save(Config.VEC_PATH, self.V if self.V is not None else np.zeros((0, Config.EMBED_DIM), dtype=np.float32))
         self._save_registry()
+        self._publish()
         self.last_updated = time.time()
 
     def remove_pdfs(self, pdf_paths: List[str]):
@@ -571,110 +1189,348 @@ class RAGIndex:
 
     def _load_from_disk(self):
         if os.path.exists(Config.META_PATH):
-            with open(Config.META_PATH, "r", encoding="utf-8") as f:
-                self.metas = [json.loads(line) for line in f if line.strip()]
+            self.metas = _read_jsonl(Config.META_PATH)
         else:
             self.metas = []
-        if os.path.exists(Config.VEC_PATH):
-            self.V = np.load(Config.VEC_PATH)
+        self._load_alive()
+        self.file_ranges = {}
+        self._index_ranges(0)
+        if self._map_vectors():
+            self._load_ann()
+            self._schedule_ann()
         else:
-            self.V = np.zeros((0, Config.EMBED_DIM), dtype=np.float32)
+            if os.path.exists(Config.VEC_LEGACY_PATH):
+                # one-time migration from the old .npy snapshot
+                self._set_vectors(np.load(Config.VEC_LEGACY_PATH))
+            else:
+                # nothing on disk yet; the vector file is created by the first append
+                self._V_buf, self._V_len = None, 0
+                self.V = np.zeros((0, Config.EMBED_DIM), dtype=np.float32)
         if os.path.exists(Config.FILES_REG_PATH):
-            with open(Config.FILES_REG_PATH, "r", encoding="utf-8") as f:
-                self.files_reg = json.load(f)
+            self.files_reg = _read_json(Config.FILES_REG_PATH)
         else:
             self.files_reg = {}
+        self._publish()
         if self.metas and self.V is not None:
             self.last_updated = time.time()
 
     def _save_registry(self):
-        with open(Config.FILES_REG_PATH, "w", encoding="utf-8") as f:
-            json.dump(self.files_reg, f, indent=2)
+        _write_json(Config.FILES_REG_PATH, self.files_reg)
+
+    # Vectors live in a raw float32 file (Config.VEC_PATH) that is memory-mapped with
+    # spare capacity; Config.VEC_SHAPE_PATH records how many rows are filled. Appends grow
+    # the file and write only the new rows; self.V is a view of the filled rows. Mappings start
+    # at file offset 0, so V is page-aligned (and rows are 64B-aligned when dim % 16 == 0).
+    def _write_vec_shape(self, rows: int, dim: int):
+        tmp = Config.VEC_SHAPE_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"rows": rows, "dim": dim}, f)
+        os.replace(tmp, Config.VEC_SHAPE_PATH)
+
+    def _map_vectors(self) -> bool:
+        if not (os.path.exists(Config.VEC_PATH) and os.path.exists(Config.VEC_SHAPE_PATH)):
+            return False
+        try:
+            with open(Config.VEC_SHAPE_PATH, "r", encoding="utf-8") as f:
+                shape = json.load(f)
+            rows, dim = int(shape["rows"]), int(shape["dim"])
+        except Exception:
+            return False
+        cap = os.path.getsize(Config.VEC_PATH) // (4 * dim)
+        if cap == 0:
+            return False
+        self._V_buf = np.memmap(Config.VEC_PATH, dtype=np.float32, mode="r+", shape=(cap, dim))
+        self._V_len = min(rows, cap)
+        self.V = self._V_buf[:self._V_len]
+        self._quantize_from(0)
+        return True
+
+    def _set_vectors(self, V: np.ndarray):
+        # full rewrite into a new file swapped in atomically; readers holding the old
+        # mapping keep a valid view of the old file
+        n, dim = int(V.shape[0]), int(V.shape[1])
+        cap = max(1024, 2 * n)
+        tmp = Config.VEC_PATH + ".tmp"
+        with open(tmp, "wb") as f:
+            f.truncate(cap * dim * 4)
+        buf = np.memmap(tmp, dtype=np.float32, mode="r+", shape=(cap, dim))
+        buf[:n] = V
+        buf.flush()
+        os.replace(tmp, Config.VEC_PATH)
+        self._write_vec_shape(n, dim)
+        self._V_buf = buf
+        self._V_len = n
+        self.V = buf[:n]
+        self._quantize_from(0)
+        self._drop_ann()
+        self._schedule_ann()
+
+    def _drop_ann(self):
+        with self._ann_lock:
+            self._vec_gen += 1
+            self._ann_state = (None, 0)
+        try:
+            os.remove(Config.ANN_PATH)
+        except OSError:
+            pass
+
+    def _load_ann(self):
+        if not (_HAS_HNSWLIB and os.path.exists(Config.ANN_PATH) and self._V_len):
+            return
+        try:
+            index = hnswlib.Index(space="ip", dim=self._V_buf.shape[1])
+            index.load_index(Config.ANN_PATH)
+            rows = index.get_current_count()
+            if rows > self._V_len:
+                raise ValueError("graph is ahead of the vector file")
+            index.set_ef(Config.ANN_EF)
+            _mark_dead(index, np.flatnonzero(~self._alive[:rows]))
+            self._ann_state = (index, rows)
+        except Exception as e:
+            print(f"[WARN] ignoring ANN index: {e}")
+            self._drop_ann()
+
+    def _schedule_ann(self):
+        if not _HAS_HNSWLIB or self._V_len < Config.ANN_THRESHOLD:
+            return
+        ann, rows = self._ann_state
+        if ann is not None and self._V_len - rows <= rows // 10:
+            return  # small exact-scored tail; not worth a rebuild yet
+        with self._ann_lock:
+            if self._ann_building:
+                return
+            self._ann_building = True
+        threading.Thread(target=self._build_ann, daemon=True).start()
+
+    def _build_ann(self):
+        try:
+            gen, V = self._vec_gen, self.V
+            n, dim = V.shape
+            index = hnswlib.Index(space="ip", dim=dim)
+            index.init_index(max_elements=n, ef_construction=200, M=16)
+            index.add_items(V, np.arange(n))
+            index.set_ef(Config.ANN_EF)
+            with self._ann_lock:
+                if gen == self._vec_gen:  # rows were not renumbered while we built
+                    _mark_dead(index, np.flatnonzero(~self._alive[:n]))
+                    index.save_index(Config.ANN_PATH)
+                    self._ann_state = (index, n)
+        except Exception as e:
+            print(f"[WARN] ANN build failed: {e}")
+            return
+        finally:
+            self._ann_building = False
+        self._schedule_ann()  # catch appends or rewrites that landed during the build
+
+    def _quantize_from(self, start: int):
+        """Quantize filled rows [start, _V_len) into the int8 buffers, growing them as needed."""
+        if not self._int8:
+            return
+        cap, dim = self._V_buf.shape
+        if self._Vq_buf is None or self._Vq_buf.shape != (cap, dim):
+            Vq, Vs = _aligned_empty((cap, dim), np.int8), _aligned_empty(cap, np.float32)
+            if start > 0:
+                Vq[:start], Vs[:start] = self._Vq_buf[:start], self._Vs_buf[:start]
+            self._Vq_buf, self._Vs_buf = Vq, Vs
+        for s in range(start, self._V_len, 8192):  # bounded float temporaries
+            e = min(s + 8192, self._V_len)
+            self._Vq_buf[s:e], self._Vs_buf[s:e] = quantize_int8(self._V_buf[s:e])
+        self._Vq_len = self._V_len
 
     def _append_index(self, new_metas: List[Dict[str, Any]], new_vecs: np.ndarray):
-        self.metas.extend(new_metas)
-        if self.V is None or self.V.size == 0:
-            self.V = new_vecs.copy()
+        """Assumes self.lock is already held (a compaction may swap metas and vectors)."""
+        if self._V_len == 0 or self._V_buf.shape[1] != new_vecs.shape[1]:
+            self._set_vectors(new_vecs)
         else:
-            self.V = np.vstack([self.V, new_vecs])
-        with open(Config.META_PATH, "a", encoding="utf-8") as f:
-            for r in new_metas:
-                f.write(json.dumps(r, ensure_ascii=False) + "\n")
-        np.save(Config.VEC_PATH, self.V)
+            dim = self._V_buf.shape[1]
+            need = self._V_len + int(new_vecs.shape[0])
+            if need > self._V_buf.shape[0]:
+                # geometric growth; the file only ever grows here, so older views stay valid
+                cap = max(need, 2 * self._V_buf.shape[0])
+                self._V_buf.flush()
+                os.truncate(Config.VEC_PATH, cap * dim * 4)
+                self._V_buf = np.memmap(Config.VEC_PATH, dtype=np.float32, mode="r+", shape=(cap, dim))
+            self._V_buf[self._V_len:need] = new_vecs
+            self._V_buf.flush()
+            self._write_vec_shape(need, dim)
+            start, self._V_len = self._V_len, need
+            self.V = self._V_buf[:need]
+            self._quantize_from(start)
+        self._schedule_ann()
+        start = len(self.metas)
+        self.metas.extend(new_metas)
+        self._grow_alive(len(self.metas))
+        self._index_ranges(start)
+        with open(Config.META_PATH, "ab") as f:
+            f.write(b"".join(_json_line(r) for r in new_metas))
+        self._publish()
         self.last_updated = time.time()
 
     def _extract_and_embed(self, pdf_paths: List[str]) -> Tuple[List[Dict[str, Any]], np.ndarray]:
         rows: List[Dict[str, Any]] = []
-        for p in pdf_paths:
-            rows.extend(extract_pdf_chunks(p))
+        tasks = [(p, None) for p in pdf_paths]
+        pool = None
+        if Config.PDF_EXTRACT_WORKERS > 1:
+            # small batches extract in-process faster than the pool can hand them out
+            counts = _page_counts(pdf_paths)
+            if sum(counts) >= Config.PDF_EXTRACT_POOL_PAGES:
+                tasks = _page_spans(pdf_paths, counts, Config.PDF_EXTRACT_WORKERS)
+                pool = _get_extract_pool()
+        if pool is not None:
+            try:
+                # map keeps task order, so rows stay in (pdf, page) order
+                for chunk_rows in pool.map(extract_pdf_chunks, *zip(*tasks), chunksize=1):
+                    rows.extend(chunk_rows)
+            except BrokenProcessPool:
+                logging.warning("PDF extraction pool died; extracting in-process")
+                _drop_extract_pool(pool)
+                rows, pool = [], None
+        if pool is None:
+            for p, pages in tasks:
+                rows.extend(extract_pdf_chunks(p, pages))
         texts = [r["text"] for r in rows]
         M = embed_texts(texts, Config.EMBED_MODEL, Config.EMBED_DIM,
-                        "RETRIEVAL_DOCUMENT", cache_fp=Config.EMBED_CACHE_PATH)
+                        "RETRIEVAL_DOCUMENT", cache_fp=Config.EMBED_CACHE_VEC_PATH)
         M = l2norm_rows(M)
         return rows, M
 
     def index_pdfs(self, pdf_paths: List[str]):
         if not pdf_paths:
             return
+        entries = []
+        for p in pdf_paths:
+            ap = os.path.abspath(p)
+            try:
+                entries.append((ap, os.stat(ap).st_mtime))  # one syscall for exists + mtime
+            except OSError:
+                continue
+        self._index_entries(entries)
+
+    def _index_entries(self, entries: List[Tuple[str, float]]):
+        """Index (abs_path, mtime) pairs whose mtime differs from the registry."""
+        if not entries:
+            return
         with self.lock:
             self.is_indexing = True
         try:
-            paths_to_index = []
-            for p in pdf_paths:
-                ap = os.path.abspath(p)
-                if not os.path.exists(ap):
-                    continue
-                mt = os.path.getmtime(ap)
+            mtimes = {}
+            for ap, mt in entries:
                 rec = self.files_reg.get(ap)
                 if (rec is None) or (abs(rec.get("mtime", 0.0) - mt) > 1e-6):
-                    paths_to_index.append(ap)
+                    mtimes[ap] = mt
+            paths_to_index = list(mtimes)
             if not paths_to_index:
                 return
+            # extraction and embedding run unlocked; only the index write is serialized
             rows, M = self._extract_and_embed(paths_to_index)
-            if rows:
-                self._append_index(rows, M)
             by_file = {}
             for r in rows:
                 by_file.setdefault(r["pdf_path"], 0)
                 by_file[r["pdf_path"]] += 1
-            for ap in paths_to_index:
-                self.files_reg[ap] = {"mtime": os.path.getmtime(ap), "chunks": by_file.get(ap, 0)}
-            self._save_registry()
+            with self.lock:
+                # a changed file's previous rows share its chunk ids; retire them first
+                if self._tombstone_locked(paths_to_index) and not rows:
+                    self._publish()
+                if rows:
+                    self._append_index(rows, M)
+                for ap in paths_to_index:
+                    self.files_reg[ap] = {"mtime": mtimes[ap], "chunks": by_file.get(ap, 0)}
+                self._save_registry()
         finally:
             with self.lock:
                 self.is_indexing = False
 
     def index_all_in_uploads(self):
-        pdfs = sorted(glob.glob(os.path.join(Config.UPLOAD_DIR, "*.pdf")))
-        self.index_pdfs(pdfs)
+        # one scandir pass: is_file() uses the d_type readdir returns; stat() is still one
+        # syscall per PDF on POSIX (cached from the directory read only on Windows)
+        entries = []
+        with os.scandir(Config.UPLOAD_DIR) as it:
+            for e in it:
+                if e.name.endswith(".pdf") and not e.name.startswith(".") and e.is_file():
+                    entries.append((os.path.abspath(e.path), e.stat().st_mtime))
+        entries.sort()
+        self._index_entries(entries)
+
+    def _sims_out(self, n: int) -> np.ndarray:
+        # per thread, since concurrent requests search at the same time
+        buf = getattr(self._tls, "sims", None)
+        if buf is None or buf.shape[0] < n:
+            cap = self._V_buf.shape[0] if self._V_buf is not None else 0
+            buf = _aligned_empty(max(n, cap), np.float32)
+            self._tls.sims = buf
+        return buf[:n]
+
+    def _score_queries(self, Q: np.ndarray, ks: List[int]) -> List[Tuple[Any, ...]]:
+        """(metas, n, idxs, scores) per query row, all scored against one snapshot."""
+        # n is already min(rows, metas): they can drift if an index write was interrupted
+        V, metas, n, Vq, Vs, dead = self._snapshot
+        # tombstoned rows score -inf, and k never exceeds the live rows, so none are returned
+        ks = [min(k, n - len(dead)) for k in ks]
+        if n - len(dead) <= 0:
+            return [(metas, 0) + _top_k(np.empty(0, dtype=np.float32), 0) for _ in ks]
+        Q = l2norm_rows(np.ascontiguousarray(Q, dtype=np.float32))
+        hits: List[Tuple[np.ndarray, np.ndarray]] = []
+        ann, ann_rows = self._ann_state
+        if ann is not None and 0 < ann_rows <= n:
+            # graph search over the indexed prefix, exact scores for rows appended since;
+            # the graph already skips tombstoned rows
+            dead_in_graph = int(np.searchsorted(dead, ann_rows))
+            k_graph = min(max(ks), ann_rows - dead_in_graph)
+            if k_graph > 0:
+                labels, dists = ann.knn_query(Q, k=k_graph)
+            else:
+                labels = dists = np.empty((len(ks), 0), dtype=np.float32)
+            tail = Q @ V[ann_rows:n].T if ann_rows < n else None
+            if tail is not None and dead_in_graph < len(dead):
+                tail[:, dead[dead_in_graph:] - ann_rows] = -np.inf
+            for b, k in enumerate(ks):
+                cand = labels[b].astype(np.int64)
+                cand_s = 1.0 - dists[b]
+                if tail is not None:
+                    cand = np.concatenate([cand, np.arange(ann_rows, n)])
+                    cand_s = np.concatenate([cand_s, tail[b]])
+                order = np.argsort(-cand_s)[:k]
+                hits.append((cand[order], cand_s[order]))
+        elif Vq is not None:
+            for qv, k in zip(Q, ks):
+                # int8 rows stream a quarter of the bytes; int32 accumulation in the kernel
+                sims = self._sims_out(n)
+                q_q, q_s = quantize_int8(qv[None, :])
+                _int8_scores(Vq, Vs, q_q[0], q_s[0], sims)
+                sims[dead] = -np.inf
+                # shortlist on the approximate scores, then rank by exact float32 scores
+                cand, _ = _top_k(sims, min(n - len(dead), max(k, Config.RAG_INT8_RERANK)))
+                cand.sort()  # ascending rows read the memmap sequentially
+                idxs, scores = _top_k(V[cand] @ qv, k)
+                hits.append((cand[idxs], scores))
+        elif len(ks) == 1:
+            # BLAS sgemv straight into a reused per-thread buffer
+            sims = self._sims_out(n)
+            np.dot(V[:n], Q[0], out=sims)
+            sims[dead] = -np.inf
+            hits.append(_top_k(sims, ks[0]))
+        else:
+            # one sgemm streams V once for the whole batch instead of once per query
+            step = max(1, _SCORE_BLOCK // n)
+            for b0 in range(0, len(ks), step):
+                S = Q[b0:b0 + step] @ V[:n].T
+                S[:, dead] = -np.inf
+                hits.extend(_top_k(S[b], ks[b0 + b]) for b in range(S.shape[0]))
+        return [(metas, n) + h for h in hits]
 
     def topk_search(self, q: str, k: int) -> List[Dict[str, Any]]:
-        if self.V is None or self.V.shape[0] == 0:
-            return []
-        Q = embed_texts([q], Config.EMBED_MODEL, Config.EMBED_DIM, "QUESTION_ANSWERING", cache_fp=None)
-        if Q.shape[0] == 0:
-            return []
-        qv = Q[0]
-        qv = qv / (np.linalg.norm(qv) + 1e-12)
-        # Guard: vectors and metas can drift if an index write was interrupted.
-        n_vecs = int(self.V.shape[0])
-        n_meta = int(len(self.metas))
-        n = min(n_vecs, n_meta)
-        if n <= 0:
+        if self._snapshot[2] <= 0:
             return []
-        sims = (self.V[:n] @ qv)
-        k = min(k, n)
-        idxs = np.argpartition(-sims, k-1)[:k]
-        idxs = idxs[np.argsort(-sims[idxs])]
+        metas, n, idxs, scores = self._search_batcher.submit(q, k).result()
         out: List[Dict[str, Any]] = []
-        for rank, i in enumerate(idxs, start=1):
+        for rank, (i, score) in enumerate(zip(idxs, scores), start=1):
             # Extra safety in case of any lingering mismatch
-            if i < 0 or i >= len(self.metas):
+            if i < 0 or i >= n:
                 continue
-            m = self.metas[i]
+            m = metas[i]
             txt = (m["text"] or "")[:Config.CTX_SNIPPET_CHARS]
             out.append({
-                "rank": rank, "score": float(sims[i]),
+                "rank": rank, "score": float(score),
                 "pdf_name": m["pdf_name"], "pdf_path": m["pdf_path"],
                 "page": m["page"], "start": m["start"], "end": m["end"],
                 "text": txt, "chunk_id": m.get("id"),
@@ -716,7 +1572,7 @@ def hybrid_answer(
     If top-1 similarity >= threshold -> plain RAG (same as .answer()).
     Otherwise -> LLM over precomputed top snippets sidecars.
     """
-    conf_threshold = float(conf_threshold if conf_threshold is not None else _chat_conf_threshold())
+    conf_threshold = float(conf_threshold if conf_threshold is not None else _CHAT_CONF_THRESHOLD)
 
     # 1) Get normal RAG contexts
     contexts = rag.topk_search(query, top_k)
@@ -758,7 +1614,7 @@ def hybrid_answer(
     snips = _choose_relevant_snippets_for_query(
         q=query,
         sidecars=sidecars,
-        total_budget_chars=_snip_ctx_budget_chars(),
+        total_budget_chars=_SNIP_CTX_BUDGET,
         max_per_pdf=max_snippets_per_pdf,
         max_total_snippets=max_snippets_total,
     )
@@ -782,7 +1638,7 @@ def hybrid_answer(
                 "threshold": conf_threshold,
                 "rank1_score": float(rank1.get("score", 0.0)),
                 "isIndexing": rag.is_indexing,
-                "chunks": int(0 if rag.V is None else rag.V.shape[0]),
+                "chunks": rag.live_rows,
             }
         }
     except Exception as e:
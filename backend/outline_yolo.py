@@ -1,14 +1,19 @@
 # outline_yolo.py
 # Extract H1/H2/H3 headings from a single PDF using DocLayout-YOLO + PyMuPDF.
 
+import copy
+import functools
 import os
+import queue
 import re
-from pathlib import Path
-from typing import Dict, Any, List, Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 
 import fitz  # PyMuPDF
 import cv2
-from PIL import Image
 import numpy as np
 
 # Try both class names to be robust across versions
@@ -17,17 +22,27 @@ try:
 except Exception:
     from doclayout_yolo import YOLO as _YOLO  # fallback
 
-try:
-    from sklearn.cluster import KMeans
-    _HAS_SKLEARN = True
-except Exception:
-    _HAS_SKLEARN = False
+# pages rendered and sent through model.predict together; bounds the page images held at once
+YOLO_BATCH = max(1, int(os.getenv("YOLO_BATCH", "8")))
+# how long a partial batch waits for the renderer before it is sent anyway
+YOLO_BATCH_WAIT = float(os.getenv("YOLO_BATCH_WAIT_MS", "50")) / 1000.0
+_QUEUE_DEPTH = 4  # items buffered between pipeline stages
+_IMGSZ = 1024  # detector input size (long side)
+# threads rasterizing pages; get_pixmap releases the GIL, so these render in parallel
+YOLO_RENDER_WORKERS = int(os.getenv("YOLO_RENDER_WORKERS", "0")) or min(8, os.cpu_count() or 1)
+
+# above this many candidates the O(n^2) exact split search falls back to quantile buckets
+_EXACT_1D_MAX = 1000
+# headings are read from the text layer, so pages without any text are never rendered
+YOLO_SKIP_EMPTY = os.getenv("YOLO_SKIP_EMPTY", "1") == "1"
+_WS_RE = re.compile(r"\s+")
+_BULLET_RE = re.compile(r"^[•\-\u2022\.\s]+")
 
 
 def _clean_text(t: str) -> str:
-    t = re.sub(r"\s+", " ", (t or "").strip())
-    t = re.sub(r"^[•\-\u2022\.\s]+", "", t)
-    return t
+    if not t:
+        return ""
+    return _BULLET_RE.sub("", _WS_RE.sub(" ", t.strip()))
 
 
 def _is_title_like(name: str) -> bool:
@@ -43,6 +58,30 @@ def _is_title_like(name: str) -> bool:
     return False
 
 
+def _split_1d(h: np.ndarray, w: np.ndarray, K: int) -> List[int]:
+    """
+    Exact 1-D k-means for K in (2, 3) over sorted values `h` with multiplicities `w`:
+    the optimal clusters are contiguous runs, so try every split and keep the one with
+    the least total squared error. Returns the start index of each run after the first.
+    """
+    n = h.shape[0]
+    p0 = np.concatenate(([0.0], np.cumsum(w)))
+    p1 = np.concatenate(([0.0], np.cumsum(w * h)))
+    p2 = np.concatenate(([0.0], np.cumsum(w * h * h)))
+
+    def sse(a, b):  # squared error of h[a:b] around its mean, O(1) from the prefix sums
+        s = p1[b] - p1[a]
+        return (p2[b] - p2[a]) - s * s / (p0[b] - p0[a])
+
+    if K == 2:
+        i = np.arange(1, n)
+        return [int(i[np.argmin(sse(0, i) + sse(i, n))])]
+    i, j = np.triu_indices(n - 1, k=1)
+    i, j = i + 1, j + 1  # 1 <= i < j <= n-1: three non-empty runs
+    best = int(np.argmin(sse(0, i) + sse(i, j) + sse(j, n)))
+    return [int(i[best]), int(j[best])]
+
+
 def _cluster_levels_by_height(cands: List[Dict[str, Any]]) -> List[str]:
     """
     Assign H1/H2/H3 by clustering candidate box heights.
@@ -51,43 +90,49 @@ def _cluster_levels_by_height(cands: List[Dict[str, Any]]) -> List[str]:
     if not cands:
         return []
 
-    K = min(3, len(cands))
     heights = np.array([[c["h_px"]] for c in cands], dtype=float)
-
-    if _HAS_SKLEARN and K >= 2:
-        km = KMeans(n_clusters=K, random_state=42, n_init=10)
-        labels = km.fit_predict(heights)
-        centers = km.cluster_centers_.ravel()
-        order = np.argsort(centers)[::-1]  # largest height first
+    # equal heights always share a level, so cluster the distinct values weighted by count
+    uniq, inv, counts = np.unique(-heights.ravel(), return_inverse=True, return_counts=True)
+    K = min(3, len(uniq))
+    if K == 1:
+        return ["H1"] * len(cands)
+
+    if len(uniq) <= _EXACT_1D_MAX:
+        bounds = _split_1d(-uniq, counts.astype(float), K)  # uniq is largest height first
+        levels = np.searchsorted(bounds, np.arange(len(uniq)), side="right")[inv.ravel()]
+        return [f"H{lvl + 1}" for lvl in levels]
     else:
         # Fallback: simple quantile bucketing
-        if K == 1:
-            labels = np.zeros(len(cands), dtype=int)
-            order = [0]
-        else:
-            qs = np.quantile(heights.ravel(), np.linspace(0, 1, K + 1))
-            labels = np.zeros(len(cands), dtype=int)
-            for i, h in enumerate(heights.ravel()):
-                for b in range(K):
-                    if qs[b] <= h <= qs[b + 1]:
-                        labels[i] = min(b, K - 1)
-                        break
-            means = [np.mean(heights.ravel()[labels == b]) for b in range(K)]
-            order = np.argsort(means)[::-1]
+        h = heights.ravel()
+        qs = np.quantile(h, np.linspace(0, 1, K + 1))
+        # bucket b holds qs[b] <= h <= qs[b+1], ties going to the lower bucket
+        labels = np.searchsorted(qs[1:-1], h, side="left")
+        counts = np.bincount(labels, minlength=K)
+        means = np.bincount(labels, weights=h, minlength=K) / np.maximum(counts, 1)
+        means[counts == 0] = -np.inf  # an empty bucket must not take a level
+        order = np.argsort(means)[::-1]
 
     cluster_to_level = {order[i]: f"H{i+1}" for i in range(K)}
     return [cluster_to_level[int(lab)] for lab in labels]
 
 
-def _convert_pdf_page_to_image(pdf_path: str, page_idx: int, dpi: int = 200) -> Optional[Image.Image]:
-    """Return PIL image for PDF page (0-based index)."""
+def _render_dpi(page: "fitz.Page", dpi: float) -> float:
+    """`dpi`, capped so the page's long side comes out at the detector's input size."""
+    # predict letterboxes larger images down to _IMGSZ anyway; don't render pixels it drops
+    return min(dpi, 72.0 * _IMGSZ / max(page.rect.width, page.rect.height, 1.0))
+
+
+def _render_page(doc: "fitz.Document", page_idx: int, dpi: int = 200) -> Optional[np.ndarray]:
+    """Return BGR uint8 array for a page (0-based index) of an open doc, ready for model.predict."""
     try:
-        doc = fitz.open(pdf_path)
-        page = doc[page_idx]
-        pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        doc.close()
-        return img
+        # pinned to 3-channel RGB so the samples always reshape to (h, w, 3), whatever the
+        # page's own colorspace
+        zoom = _render_dpi(doc[page_idx], dpi) / 72
+        pix = doc[page_idx].get_pixmap(matrix=fitz.Matrix(zoom, zoom),
+                                       colorspace=fitz.csRGB, alpha=False)
+        # view the pixmap's samples in place (no copy); cvtColor writes the one BGR copy we keep
+        rgb = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+        return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
     except Exception as e:
         print(f"[outline_yolo] page->img error p{page_idx+1}: {e}")
         return None
@@ -96,15 +141,205 @@ def _convert_pdf_page_to_image(pdf_path: str, page_idx: int, dpi: int = 200) ->
 # ---- Lazy model cache so we don't reload for each request ----
 _MODEL = None
 _MODEL_PATH = None
+_PREDICT_KW: Dict[str, Any] = {}  # device placement passed to every model.predict
+_MODEL_LOCK = threading.Lock()
+_PREDICT_LOCK = threading.Lock()  # one forward pass at a time on the shared model
 
 def _get_model(model_path: str):
-    global _MODEL, _MODEL_PATH
-    if _MODEL is None or _MODEL_PATH != model_path:
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"DocLayout-YOLO model not found at: {os.path.abspath(model_path)}")
-        _MODEL = _YOLO(model_path)
-        _MODEL_PATH = model_path
-    return _MODEL
+    """
+    Load (once) the DocLayout-YOLO model. With CUDA available, predictions run on GPU 0
+    in FP16; YOLO_FP32=1 keeps them in FP32, YOLO_DEVICE=cpu keeps them on the CPU.
+    """
+    global _MODEL, _MODEL_PATH, _PREDICT_KW
+    with _MODEL_LOCK:
+        if _MODEL is None or _MODEL_PATH != model_path:
+            if not os.path.exists(model_path):
+                raise FileNotFoundError(f"DocLayout-YOLO model not found at: {os.path.abspath(model_path)}")
+            _MODEL = _YOLO(model_path)
+            _MODEL_PATH = model_path
+            _PREDICT_KW = {}
+            try:
+                import torch  # installed with doclayout_yolo
+                if torch.cuda.is_available() and os.getenv("YOLO_DEVICE", "") != "cpu":
+                    # the predictor moves and casts the weights once, on its first call
+                    _PREDICT_KW = {"device": 0, "half": os.getenv("YOLO_FP32", "0") != "1"}
+            except Exception:
+                pass
+        return _MODEL
+
+
+def _page_spans(page: "fitz.Page"):
+    """(M, 4) span bboxes in PDF points, their texts, and the line each span belongs to."""
+    boxes, texts, lines = [], [], []
+    line_no = 0
+    for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+        for line in block.get("lines", ()):
+            for span in line["spans"]:
+                boxes.append(span["bbox"])
+                texts.append(span["text"])
+                lines.append(line_no)
+            line_no += 1
+    return np.array(boxes, dtype=float).reshape(-1, 4), texts, lines
+
+
+def _join_spans(idxs, texts: List[str], lines: List[int]) -> str:
+    # spans of one line run together, lines break with a newline (like get_text("text"))
+    parts, prev = [], None
+    for j in idxs:
+        if prev is not None and lines[j] != prev:
+            parts.append("\n")
+        parts.append(texts[j])
+        prev = lines[j]
+    return "".join(parts)
+
+
+def _collect_candidates(det, page, page_idx: int, dpi: float, names: Dict[int, str],
+                        wanted: frozenset, out: Dict[Tuple[int, str], Dict[str, Any]]):
+    """Add the title-like boxes of one page's detection result to `out`, keyed by
+    (page, lowercased text) and keeping the most confident box per key."""
+    if not hasattr(det, "boxes") or det.boxes is None or not len(det.boxes):
+        return
+
+    # select title-like rows where the tensors live; only those are copied to the host
+    mask = None
+    for i in wanted:
+        hit = det.boxes.cls == i
+        mask = hit if mask is None else mask | hit
+    if not mask.any():
+        return
+    boxes = det.boxes[mask]
+
+    r     = boxes.xyxy.cpu().numpy().astype(float) * (72.0 / _render_dpi(page, dpi))  # PDF points
+    xyxy  = r * (dpi / 72.0)  # reported at the requested dpi, whatever the render dpi was
+    clsid = boxes.cls.cpu().numpy().astype(int)
+    confs = boxes.conf.cpu().numpy().astype(float)
+
+    # one text extraction per page; each box takes the spans centred inside it
+    span_boxes, span_texts, span_lines = _page_spans(page)
+    cx = (span_boxes[:, 0] + span_boxes[:, 2]) / 2
+    cy = (span_boxes[:, 1] + span_boxes[:, 3]) / 2
+    hits = ((cx >= r[:, 0:1]) & (cx <= r[:, 2:3]) & (cy >= r[:, 1:2]) & (cy <= r[:, 3:4]))
+
+    for (x1, y1, x2, y2), cid, conf, hit in zip(xyxy, clsid, confs, hits):
+        txt = _clean_text(_join_spans(np.flatnonzero(hit), span_texts, span_lines))
+        if not txt:
+            continue
+        key = (page_idx, txt.lower())
+        if key in out and out[key]["conf"] >= conf:
+            continue
+
+        out[key] = {
+            "page": page_idx,  # 0-based
+            "text": txt,
+            "conf": float(conf),
+            "x1_px": float(x1), "y1_px": float(y1),
+            "x2_px": float(x2), "y2_px": float(y2),
+            "h_px": float(y2 - y1),
+            "y_top_px": float(y1),
+            "label_name": str(names.get(int(cid), cid)),
+        }
+
+
+# ---- Pipeline stages: render (thread) -> detect (thread) -> text extraction (caller) ----
+# Each stage hands items on through a bounded queue and ends with a None sentinel; a stage
+# that fails passes its exception along instead. `stop` lets the caller unblock producers.
+
+def _put(q: "queue.Queue", item: Any, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q: "queue.Queue", stop: threading.Event) -> Any:
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def _render_stage(pdf_path: str, dpi: int, out: "queue.Queue", stop: threading.Event):
+    # fitz documents are not shared across threads: each render worker parses the PDF once
+    local = threading.local()
+    docs: List["fitz.Document"] = []
+
+    def render(page_idx: int) -> Optional[np.ndarray]:
+        doc = getattr(local, "doc", None)
+        if doc is None:
+            doc = local.doc = fitz.open(pdf_path)
+            docs.append(doc)
+        if YOLO_SKIP_EMPTY and not doc[page_idx].get_text("text", flags=fitz.TEXTFLAGS_TEXT).strip():
+            return None  # nothing a detection could be matched against
+        return _render_page(doc, page_idx, dpi=dpi)
+
+    try:
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        workers = max(1, min(YOLO_RENDER_WORKERS, page_count))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outline-render") as ex:
+            # a bounded window of pages in flight, handed on in page order
+            pending = deque()
+
+            def emit() -> bool:
+                idx, fut = pending.popleft()
+                img = fut.result()
+                return img is None or _put(out, (idx, img), stop)
+
+            try:
+                for page_idx in range(page_count):
+                    pending.append((page_idx, ex.submit(render, page_idx)))
+                    if len(pending) >= 2 * workers and not emit():
+                        return
+                while pending:
+                    if not emit():
+                        return
+            finally:
+                for _, fut in pending:
+                    fut.cancel()
+        _put(out, None, stop)
+    except Exception as e:
+        _put(out, e, stop)
+    finally:
+        for doc in docs:
+            doc.close()
+
+
+def _detect_stage(model, inp: "queue.Queue", out: "queue.Queue", stop: threading.Event):
+    try:
+        done = False
+        while not done:
+            item = _get(inp, stop)
+            if item is None or isinstance(item, Exception):
+                _put(out, item, stop)
+                return
+            # fill the batch until it is full, the renderer is done, or the wait runs out
+            batch = [item]
+            deadline = time.monotonic() + YOLO_BATCH_WAIT
+            while len(batch) < YOLO_BATCH:
+                try:
+                    item = inp.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None or isinstance(item, Exception):
+                    done = True
+                    break
+                batch.append(item)
+
+            # one forward pass per batch of in-memory BGR pages (no temp files)
+            with _PREDICT_LOCK:
+                dets = model.predict([img for _, img in batch], imgsz=_IMGSZ, conf=0.2, verbose=False,
+                                     **_PREDICT_KW)
+            for (page_idx, _), det in zip(batch, dets):
+                if not _put(out, (page_idx, det), stop):
+                    return
+        _put(out, item, stop)  # the sentinel or error that ended the last batch
+    except Exception as e:
+        _put(out, e, stop)
 
 
 def build_outline_for_file(pdf_path: str, model_path: str, dpi: int = 200) -> Dict[str, Any]:
@@ -120,77 +355,57 @@ def build_outline_for_file(pdf_path: str, model_path: str, dpi: int = 200) -> Di
     """
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(pdf_path)
+    st = os.stat(pdf_path)
+    # outlines are deterministic per file version + model + dpi; hand out copies of the cached one
+    return copy.deepcopy(_cached_outline(pdf_path, st.st_size, st.st_mtime_ns, model_path, dpi))
 
-    model = _get_model(model_path)
-    _SCALE = dpi / 72.0  # px per PDF point
-    doc = fitz.open(pdf_path)
 
-    title_candidates: List[Dict[str, Any]] = []
+@functools.lru_cache(maxsize=64)
+def _cached_outline(pdf_path: str, size: int, mtime_ns: int, model_path: str, dpi: int) -> Dict[str, Any]:
+    return _build_outline(pdf_path, model_path, dpi)
 
-    try:
-        for page_idx in range(doc.page_count):
-            pil_img = _convert_pdf_page_to_image(pdf_path, page_idx, dpi=dpi)
-            if pil_img is None:
-                continue
 
-            # PIL -> OpenCV (BGR)
-            cv_img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-            # Save to a temp file because doclayout_yolo .predict expects a path
-            tmp_path = str(Path(pdf_path).with_suffix(f".p{page_idx+1}.jpg"))
-            cv2.imwrite(tmp_path, cv_img)
+def _build_outline(pdf_path: str, model_path: str, dpi: int) -> Dict[str, Any]:
+    model = _get_model(model_path)
+    # class names are fixed by the model: pick the title-like ids once, not per page
+    names = getattr(model, "names", {}) or {}
+    wanted = frozenset(i for i, n in names.items() if _is_title_like(str(n)))
+    if not wanted:
+        return {"title": "", "outline": []}  # nothing this model detects could become a heading
+    doc = fitz.open(pdf_path)
 
-            try:
-                det = model.predict(tmp_path, imgsz=1024, conf=0.2)[0]
-                names = getattr(det, "names", {}) or {}
-                if not names and hasattr(det, "boxes") and hasattr(det.boxes, "cls"):
-                    uniq = np.unique(det.boxes.cls.cpu().numpy()).astype(int).tolist()
-                    names = {i: str(i) for i in uniq}
-
-                wanted = {i for i, n in names.items() if _is_title_like(str(n))}
-                if not hasattr(det, "boxes") or det.boxes is None or not len(det.boxes):
-                    continue
-
-                xyxy  = det.boxes.xyxy.cpu().numpy().astype(float)
-                clsid = det.boxes.cls.cpu().numpy().astype(int)
-                confs = det.boxes.conf.cpu().numpy().astype(float)
-
-                page = doc[page_idx]
-                for (x1, y1, x2, y2), cid, conf in zip(xyxy, clsid, confs):
-                    if cid not in wanted:
-                        continue
-                    rect = fitz.Rect(x1/_SCALE, y1/_SCALE, x2/_SCALE, y2/_SCALE)
-                    txt = _clean_text(page.get_text("text", clip=rect))
-                    if not txt:
-                        continue
-
-                    title_candidates.append({
-                        "page": page_idx,  # 0-based
-                        "text": txt,
-                        "conf": float(conf),
-                        "x1_px": float(x1), "y1_px": float(y1),
-                        "x2_px": float(x2), "y2_px": float(y2),
-                        "h_px": float(y2 - y1),
-                        "y_top_px": float(y1),
-                        "label_name": str(names.get(int(cid), cid)),
-                    })
-            finally:
-                try:
-                    os.remove(tmp_path)
-                except Exception:
-                    pass
+    # deduplicated as they are found: (page, text.lower()) -> most confident candidate
+    title_candidates: Dict[Tuple[int, str], Dict[str, Any]] = {}
+
+    # rendering and text clipping overlap with inference instead of waiting on it
+    rendered: "queue.Queue" = queue.Queue(maxsize=_QUEUE_DEPTH)
+    detected: "queue.Queue" = queue.Queue(maxsize=_QUEUE_DEPTH)
+    stop = threading.Event()
+    stages = [
+        threading.Thread(target=_render_stage, args=(pdf_path, dpi, rendered, stop),
+                         name="outline-render", daemon=True),
+        threading.Thread(target=_detect_stage, args=(model, rendered, detected, stop),
+                         name="outline-detect", daemon=True),
+    ]
+    for t in stages:
+        t.start()
+    try:
+        while True:
+            item = detected.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            page_idx, det = item
+            _collect_candidates(det, doc[page_idx], page_idx, dpi, names, wanted, title_candidates)
     finally:
+        stop.set()
         doc.close()
 
     if not title_candidates:
         return {"title": "", "outline": []}
 
-    # Dedup per (page, text) keeping highest confidence
-    dedup = {}
-    for c in title_candidates:
-        k = (c["page"], c["text"].lower())
-        if k not in dedup or c["conf"] > dedup[k]["conf"]:
-            dedup[k] = c
-    cands = list(dedup.values())
+    cands = list(title_candidates.values())
 
     # Pick doc title = largest height, then higher conf, then earliest page, then top-most
     doc_title = ""
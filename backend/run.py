@@ -8,4 +8,15 @@ if __name__ == "__main__":
     port = int(os.getenv("BACKEND_PORT", "4000"))  # <- 4000, not 3000
     debug = os.getenv("FLASK_DEBUG", "1") != "0"
 
-    app.run(host=host, port=port, debug=debug)
+    if debug:
+        app.run(host=host, port=port, debug=debug)
+    else:
+        # Multi-threaded server so requests keep flowing while
+        # rag.build_top_snippets runs in its background threads.
+        try:
+            from waitress import serve
+        except ImportError:
+            app.run(host=host, port=port, threaded=True)
+        else:
+            serve(app, host=host, port=port,
+                  threads=int(os.getenv("BACKEND_THREADS", "16")))